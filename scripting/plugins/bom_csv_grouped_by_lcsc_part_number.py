@@ -12,6 +12,10 @@
 
     Command line:
     python "pathToFile/bom_csv_grouped_by_value.py" "%I" "%O.csv"
+
+    Every component's footprint is checked against its symbol's footprint
+    filters and, if its library is in the project's or the user's global
+    fp-lib-table, that it exists. Problems are printed as warnings.
 """
 
 from __future__ import print_function
@@ -20,15 +24,20 @@ from __future__ import print_function
 import kicad_netlist_reader
 import csv
 import sys
+from footprint_check import check_footprints, project_footprint_libraries, report_footprint_problems
+
+BOM_NETLIST_SECTIONS = {'design', 'components', 'libparts'}
 
 
-def generate_bom(net, f):
+def generate_bom(net, f, footprint_libraries=None):
 
     # subset the components to those wanted in the BOM, controlled
     # by <configure> block in kicad_netlist_reader.py
     components = net.getInterestingComponents()
-    # Group them, based on the myEqu comparison function (which matches LCSC Part #)
-    grouped = net.groupComponents(components)
+    # Group them by LCSC Part # (see lcsc_group_key)
+    grouped = net.groupComponents(components, key=lcsc_group_key)
+    report_lcsc_mismatches(grouped)
+    report_footprint_problems(check_footprints(components, footprint_libraries))
 
     columns = ['Item', 'LCSC Part #', 'Qty', 'Reference(s)', 'Value', 'LibPart', 'Footprint']
 
@@ -72,26 +81,37 @@ def generate_bom(net, f):
         writerow(out, row)
 
 
-def myEqu(self, other):
-    """myEqu is a more advanced equivalence function for components which is
-    used by component grouping. Normal operation is to group components based
-    on their value and footprint.
+def lcsc_group_key(component):
+    """Grouping key for components: group by LCSC Part #, and then also split on
+    footprint, value and library part so that mismatched components don't end up
+    on the same BOM line. Components without an LCSC Part # are never grouped.
+    """
+    lcsc_part_no = component.getField('LCSC Part #')
+    if lcsc_part_no == '':
+        return None
+    return lcsc_part_no, component.getFootprint(), component.getValue(), component.getLibPart()
 
-    In this case, group by LCSC Part #, and then also check that the footpring, value and library match, and print a warning if they don't
+
+def report_lcsc_mismatches(grouped):
+    """Print a warning for each group that shares an LCSC Part # with an earlier group,
+    which means that the footprint, value or library part of the components don't match
     """
-    result = False
     fields_to_check = ['getFootprint', 'getValue', 'getLibPart']
-    if self.getField('LCSC Part #') == other.getField('LCSC Part #'):
-        if self.getField('LCSC Part #') != '':
-            result = True  # set result to true. Then if any of the fields below don't match, it will be set back to false.
-            for field in fields_to_check:
-                val1 = getattr(self, field)()
-                val2 = getattr(other, field)()
-                if val1 != val2:
-                    result = False
-                    print('Warning components {} and {} have matching LCSC Part # ({}) but {}() mismatch: <{}> - <{}>'.format(self.getRef(), other.getRef(), self.getField('LCSC Part #'), field, val1, val2))
-
-    return result
+    first_group_for_part = {}
+    for group in grouped:
+        lcsc_part_no = group[0].getField('LCSC Part #')
+        if lcsc_part_no == '':
+            continue
+        if lcsc_part_no not in first_group_for_part:
+            first_group_for_part[lcsc_part_no] = group
+            continue
+        first = first_group_for_part[lcsc_part_no][0]
+        other = group[0]
+        for field in fields_to_check:
+            val1 = getattr(first, field)()
+            val2 = getattr(other, field)()
+            if val1 != val2:
+                print('Warning components {} and {} have matching LCSC Part # ({}) but {}() mismatch: <{}> - <{}>'.format(first.getRef(), other.getRef(), lcsc_part_no, field, val1, val2))
     
     
 def check_args():
@@ -113,18 +133,14 @@ def get_output_file():
 
 def run():
     check_args()
-    
-    # Override the component equivalence operator - it is important to do this
-    # before loading the netlist, otherwise all components will have the original
-    # equivalency operator.
-    kicad_netlist_reader.comp.__eq__ = myEqu
 
     # Generate an instance of a generic netlist, and load the netlist tree from
-    # the command line option. If the file doesn't exist, execution will stop
-    net = kicad_netlist_reader.netlist(sys.argv[1])
+    # the command line option. If the file doesn't exist, execution will stop.
+    # The BOM doesn't use the nets, so don't load them.
+    net = kicad_netlist_reader.netlist(sys.argv[1], sections=BOM_NETLIST_SECTIONS)
 
     outfile = get_output_file()
-    generate_bom(net, outfile)
+    generate_bom(net, outfile, project_footprint_libraries(sys.argv[1]))
     outfile.close()
     
 
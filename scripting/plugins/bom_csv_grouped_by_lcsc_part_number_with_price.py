@@ -12,38 +12,81 @@
 
     Command line:
     python "pathToFile/bom_csv_grouped_by_value.py" "%I" "%O.csv"
+
+    Prices come from the LCSC part database where possible. Cached prices older
+    than --max-age days are still used, but are marked as stale in the BOM, and
+    are refreshed by a background process once the BOM has been written (or
+    before it is written, with --refresh). To just refresh the stale parts in the
+    part database:
+    python "pathToFile/bom_csv_grouped_by_lcsc_part_number_with_price.py" --refresh-stale
+    The background process only refreshes the BOM's stale parts (given with
+    --parts), and only one refresh runs at a time: a refresh started while another
+    is running exits straight away.
+
+    Nothing is fetched from LCSC or the exchange rate API unless a part or rate
+    isn't cached; with --offline nothing is fetched at all, and parts which
+    aren't in the part database are left unpriced.
+
+    Each part is priced at the LCSC price break for its quantity times --boards,
+    summed over the lines it is on. With --cheapest-order, a part's order quantity
+    is raised to the next price break up wherever that is cheaper overall.
+
+    Every component's footprint is checked against its symbol's footprint
+    filters, taken from the netlist or from the .lib files given with
+    --symbol-lib, and (if there are any footprint libraries, from the user's global
+    fp-lib-table, the project's fp-lib-table or --fp-lib-table, and --footprint-dir)
+    that it exists. Problems are printed as warnings.
 """
 
 from __future__ import print_function
 
-# Import the KiCad python helper module and the csv formatter
-import kicad_netlist_reader
+# The KiCad python helper module is imported in run(), only when there is a
+# netlist to read. Anything which is only needed in some modes is imported when
+# it's needed, as eeschema starts a new python for every BOM it generates.
+import argparse
+import contextlib
 import csv
+import os
 import sys
-import requests
-import re
-import time
-import datetime
-import shelve
 import tempfile
-import os
-
-cache_filename = os.path.join(tempfile.gettempdir(), 'lcsc_part_cache')
-exchange_rate = None
-
-
-def generate_bom(net, f, headers, cookies):
-
-    part_cache = PartCache(cache_filename, ttl=None)
+import time
+from currency import ExchangeRates, default_currency
+from footprint_check import (check_footprints, load_symbol_filters, project_footprint_libraries,
+                             report_footprint_problems)
+from lcsc_client import LcscClient
+from lcsc_part_db import PartDatabase
+from price_breaks import PriceTable, cost_lines
+
+BOM_NETLIST_SECTIONS = {'design', 'components', 'libparts'}
+DEFAULT_MAX_AGE_DAYS = 7
+# held by the --refresh-stale process, so only one runs at a time
+REFRESH_LOCK_FILENAME = os.path.join(tempfile.gettempdir(), 'lcsc_refresh.lock')
+
+
+def generate_bom(net, f, part_db, client, rates, currency, max_age, refresh=False, boards=1, cheapest=False,
+                 footprint_libraries=None, symbol_filters=None):
+    """Write the BOM for net to f, with prices in currency, and return the set of part
+    numbers whose prices are stale.
+
+    Each part is priced at the price break for its quantity (over all of its lines)
+    times the number of boards. If cheapest is set, the order quantity of each part is
+    bumped up to a higher price break wherever that costs less in total.
+
+    The components' footprints are checked against footprint_libraries and
+    symbol_filters first, see footprint_check.check_footprints().
+    """
 
     # subset the components to those wanted in the BOM, controlled
     # by <configure> block in kicad_netlist_reader.py
     components = net.getInterestingComponents()
-    # Group them, based on the myEqu comparison function (which matches LCSC Part #)
-    grouped = net.groupComponents(components)
+    # Group them by LCSC Part # (see lcsc_group_key)
+    grouped = net.groupComponents(components, key=lcsc_group_key)
+    report_lcsc_mismatches(grouped)
+    report_footprint_problems(check_footprints(components, footprint_libraries, symbol_filters))
 
     columns = ['Item', 'LCSC Part #', 'Qty', 'Reference(s)', 'Value', 'LibPart', 'Footprint',
-               'LCSC Footprint', 'Price per unit', 'Price total', 'in stock']
+               'LCSC Footprint', 'Price per unit', 'Price total', 'Order qty', 'Order total', 'in stock',
+               'Stale price']
 
     # Create a new csv writer object to use as the output formatter
     out = csv.writer(f, lineterminator='\n', delimiter=',', quotechar='\"', quoting=csv.QUOTE_ALL)
@@ -62,10 +105,26 @@ def generate_bom(net, f, headers, cookies):
     writerow(out, ['Generator:', sys.argv[0]])
     writerow(out, ['Component Count:', len(components)])
     writerow(out, ['Unique component Count:', len(grouped)])
+    writerow(out, ['Boards:', boards])
     writerow(out, [])                        # blank line
     writerow(out, columns)
 
+    # Look up all the parts up front, so the ones which aren't in the part database
+    # can be fetched in parallel
+    parts, stale = lookup_parts([group[0].getField('LCSC Part #') for group in grouped
+                                 if group[0].getField('LCSC Part #') != ''],
+                                part_db, client, max_age, refresh)
+    # Convert every part's price breaks to currency in one go, and then cost every line.
+    # Lines with the same part number are one order, so they're costed together
+    price_tables = rates.convert_tables({part_no: part.price_breaks for part_no, part in parts.items()}, currency)
+    price_tables = {part_no: PriceTable(price_breaks) for part_no, price_breaks in price_tables.items()
+                    if price_breaks}
+    part_numbers = [group[0].getField('LCSC Part #') for group in grouped]
+    costs = cost_lines([price_tables.get(part_no) for part_no in part_numbers],
+                       [len(group) * boards for group in grouped], cheapest, keys=part_numbers)
+
     cumulative_total_price = 0
+    cumulative_order_price = 0
     items_without_price = []
     # Print a line for each group
     for index, group in enumerate(grouped):
@@ -76,16 +135,26 @@ def generate_bom(net, f, headers, cookies):
         lcsc_part_no = first_component.getField('LCSC Part #')
         
         if lcsc_part_no != '':
-            price, in_stock, footprint = lookup_part_info(lcsc_part_no, part_cache, headers, cookies)
-            if isinstance(price, float):
-                total_price = price * len(group)
+            in_stock, footprint = get_part_info(parts.get(lcsc_part_no))
+            cost = costs[index]
+            if cost is not None:
+                price = cost.unit_price
+                total_price = cost.unit_price * cost.quantity
+                order_qty = cost.order_quantity
+                order_price = cost.total
                 cumulative_total_price += total_price
+                cumulative_order_price += order_price
             else:
+                price = None
                 total_price = 'Error'
+                order_qty = ''
+                order_price = 'Error'
                 items_without_price.append(first_component.getPartName())
         else:
             price = ''
             total_price = ''
+            order_qty = ''
+            order_price = ''
             in_stock = ''
             footprint = ''
             items_without_price.append(first_component.getPartName())
@@ -102,219 +171,250 @@ def generate_bom(net, f, headers, cookies):
         row.append(footprint)
         row.append(price)
         row.append(total_price)
+        row.append(order_qty)
+        row.append(order_price)
         row.append(in_stock)
+        row.append('stale' if lcsc_part_no in stale else '')
 
         writerow(out, row)
 
-    print('Total price: {}'.format(cumulative_total_price))
+    print('Total price: {} {}'.format(cumulative_total_price, currency))
+    print('Total order price: {} {}'.format(cumulative_order_price, currency))
     print('Num items without price: {}'.format(len(items_without_price)))
     for item in items_without_price:
         print('   {}'.format(item))
+    if stale:
+        print('Num items with stale prices: {}'.format(len(stale)))
+    return stale
+
 
+def lcsc_group_key(component):
+    """Grouping key for components: group by LCSC Part #, and then also split on
+    footprint, value and library part so that mismatched components don't end up
+    on the same BOM line. Components without an LCSC Part # are never grouped.
+    """
+    lcsc_part_no = component.getField('LCSC Part #')
+    if lcsc_part_no == '':
+        return None
+    return lcsc_part_no, component.getFootprint(), component.getValue(), component.getLibPart()
 
-def myEqu(self, other):
-    """myEqu is a more advanced equivalence function for components which is
-    used by component grouping. Normal operation is to group components based
-    on their value and footprint.
 
-    In this case, group by LCSC Part #, and then also check that the footpring, value and library match, and print a warning if they don't
+def report_lcsc_mismatches(grouped):
+    """Print a warning for each group that shares an LCSC Part # with an earlier group,
+    which means that the footprint, value or library part of the components don't match
     """
-    result = False
     fields_to_check = ['getFootprint', 'getValue', 'getLibPart']
-    if self.getField('LCSC Part #') == other.getField('LCSC Part #'):
-        if self.getField('LCSC Part #') != '':
-            result = True  # set result to true. Then if any of the fields below don't match, it will be set back to false.
-            for field in fields_to_check:
-                val1 = getattr(self, field)()
-                val2 = getattr(other, field)()
-                if val1 != val2:
-                    result = False
-                    print('Warning components {} and {} have matching LCSC Part # ({}) but {}() mismatch: <{}> - <{}>'.format(self.getRef(), other.getRef(), self.getField('LCSC Part #'), field, val1, val2))
-
-    return result
+    first_group_for_part = {}
+    for group in grouped:
+        lcsc_part_no = group[0].getField('LCSC Part #')
+        if lcsc_part_no == '':
+            continue
+        if lcsc_part_no not in first_group_for_part:
+            first_group_for_part[lcsc_part_no] = group
+            continue
+        first = first_group_for_part[lcsc_part_no][0]
+        other = group[0]
+        for field in fields_to_check:
+            val1 = getattr(first, field)()
+            val2 = getattr(other, field)()
+            if val1 != val2:
+                print('Warning components {} and {} have matching LCSC Part # ({}) but {}() mismatch: <{}> - <{}>'.format(first.getRef(), other.getRef(), lcsc_part_no, field, val1, val2))
     
     
-def check_args():
-    if len(sys.argv) != 3:
-        print("Usage ", __file__, "<generic_netlist.xml> <output.csv>", file=sys.stderr)
-        sys.exit(1)
-        
-
-def get_output_file():
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate a CSV BOM with LCSC prices')
+    parser.add_argument('netlist', nargs='?', help='KiCad generic netlist (.xml)')
+    parser.add_argument('output', nargs='?', help='output file (.csv is appended if missing)')
+    parser.add_argument('--max-age', type=float, default=DEFAULT_MAX_AGE_DAYS,
+                        help='age in days after which cached prices are stale (default %(default)s)')
+    parser.add_argument('--refresh', action='store_true',
+                        help='fetch stale prices before writing the BOM, rather than in the background')
+    parser.add_argument('--no-background-refresh', action='store_true',
+                        help="don't refresh stale prices in the background after writing the BOM")
+    parser.add_argument('--boards', type=int, default=1,
+                        help='number of boards to price the parts for (default %(default)s)')
+    parser.add_argument('--cheapest-order', action='store_true',
+                        help='order more than needed of a part where the next price break up is cheaper')
+    parser.add_argument('--currency', default=default_currency,
+                        help='currency to give prices in (default %(default)s)')
+    parser.add_argument('--refresh-stale', action='store_true',
+                        help='refresh every stale part in the part database (or just those in --parts), and exit')
+    parser.add_argument('--parts',
+                        help='comma separated LCSC part numbers for --refresh-stale to refresh')
+    parser.add_argument('--offline', action='store_true',
+                        help="don't connect to LCSC or the exchange rate API, only use cached parts and rates")
+    parser.add_argument('--symbol-lib', action='append', default=[],
+                        help='.lib file to take symbol footprint filters from, rather than the netlist '
+                             '(can be given more than once)')
+    parser.add_argument('--fp-lib-table',
+                        help="fp-lib-table to check footprints against, as well as the global one "
+                             "(default the project's, if there is one)")
+    parser.add_argument('--footprint-dir', action='append', default=[],
+                        help='.pretty footprint library, or directory of them, to check footprints against '
+                             '(can be given more than once)')
+    args = parser.parse_args()
+    if not args.refresh_stale and (args.netlist is None or args.output is None):
+        parser.error('a netlist and output file are required')
+    if args.offline and (args.refresh or args.refresh_stale):
+        parser.error('--offline can not be used with --refresh or --refresh-stale')
+    if args.parts and not args.refresh_stale:
+        parser.error('--parts can only be used with --refresh-stale')
+    if args.boards < 1:
+        parser.error('--boards must be at least 1')
+    return args
+
+
+def get_output_file(outfile_name):
     """
     append .csv if necessary to the output file, and then open it for writing
     """
-    outfile_name = sys.argv[2]
     if not outfile_name.endswith('.csv'):
         outfile_name += '.csv'
     f = open(outfile_name, 'w')
     return f
 
 
-# LCSC lookup functions
-def obtain_csrf_token_and_cookies():
-    search_page = requests.get("https://lcsc.com/products/Pre-ordered-Products_11171.html")
-    return extract_csrf_token(search_page.text), search_page.cookies
-
-
-def extract_csrf_token(page_text):
-    m = re.search(r"'X-CSRF-TOKEN':\s*'(.*)'", page_text)
-    if not m:
-        return None
-    return m.group(1)
-    
-
-def usd2aud(usd):
-    return usd/get_exchange_rate()
-
+def get_part_info(part):
+    """Return (stock, package) for an LcscPart, or Nones if part is None"""
+    if part is None:
+        return None, None
+    return part.stock, part.package
 
-def get_exchange_rate():
-    global exchange_rate
-    if exchange_rate is None:
-        res = requests.get('https://api.exchangeratesapi.io/latest?base=AUD&symbols=USD')
-        exchange_rate = res.json()['rates']['USD']
-    return exchange_rate
 
+def lookup_parts(part_numbers, part_db, client, max_age, refresh=False):
+    """Return a dict of part number to LcscPart for part_numbers, and the set of those
+    part numbers whose info is stale (fetched more than max_age seconds ago).
 
-def lookup_part_info(part_no, part_cache, headers, cookies):
-    part = part_cache[part_no]
-    if part is None:
-        part = lcsc_lookup(part_no, headers, cookies)
-        part_cache[part_no] = part
-
-    return part
-
-
-def lcsc_lookup(part_no, headers, cookies):
-    price = None
-    in_stock = None
-    footprint = None
-    res = requests.post("https://lcsc.com/api/products/search",
-                        headers=headers, cookies=cookies,
-                        data={
-                            "current_page": "1",
-                            "in_stock": "false",
-                            "is_RoHS": "false",
-                            "show_icon": "false",
-                            "search_content": part_no,
-                        })
+    Parts are read from the part database if they're there, and the rest are fetched
+    from LCSC concurrently and added to the database. Stale parts are fetched again
+    too if refresh is set, otherwise the stale info is returned. If client is None
+    (offline), nothing is fetched.
+    """
+    part_numbers = set(part_numbers)
+    parts = dict()
+    for part_no in part_numbers:
+        part = part_db.get(part_no)
+        if part is not None:
+            parts[part_no] = part
+
+    now = time.time()
+    stale = set(part_no for part_no, part in parts.items() if now - part.fetched_at > max_age)
+    to_fetch = [part_no for part_no in part_numbers if part_no not in parts]
+    if refresh:
+        to_fetch += stale
+    if to_fetch and client is None:
+        missing = [part_no for part_no in part_numbers if part_no not in parts]
+        if missing:
+            print('Offline, so not fetching {} parts which are not in the part database'.format(len(missing)))
+    elif to_fetch:
+        print('Fetching {} parts from LCSC'.format(len(to_fetch)))
+        fetched = client.lookup_many(to_fetch)
+        part_db.put_many(fetched.values())
+        parts.update(fetched)
+        stale.difference_update(fetched)
+    return parts, stale
+
+
+def refresh_stale_parts(part_db, client, max_age, part_numbers=None):
+    """Fetch every part in the part database which is older than max_age seconds again,
+    or just those of part_numbers which are (or aren't in the database)"""
+    if part_numbers is None:
+        stale = part_db.parts_older_than(max_age)
+    else:
+        # another refresh may have got to some of them since they were found stale
+        now = time.time()
+        stale = []
+        for part_no in part_numbers:
+            part = part_db.get(part_no)
+            if part is None or now - part.fetched_at > max_age:
+                stale.append(part_no)
+    print('Refreshing {} stale parts'.format(len(stale)))
+    fetched = client.lookup_many(stale)
+    part_db.put_many(fetched.values())
+
+
+@contextlib.contextmanager
+def refresh_lock(filename=REFRESH_LOCK_FILENAME):
+    """Context manager giving True if this process got the refresh lock, or False if
+    another process holds it. The lock is an OS file lock, so it is released however
+    the process holding it exits"""
+    f = open(filename, 'a+')
     try:
-        if "exceeded the maximum number of attempts" in res.text or res.json()["code"] == 429:
-            print("Too many requests! Waiting")
-            time.sleep(10)
-            price = lcsc_lookup(part_no, headers, cookies)
-        else:
-            results = res.json()["result"]["data"]
-            if len(results) != 1:
-                print(" --Warning, {} doesn't have a single result/data section - len(results) = {}".format(part_no, len(results)))
-                print(res.text)
-            else:
-                component = res.json()["result"]["data"][0]
-                if component["number"] != part_no:
-                    print(" --Warning, {} result/data/number ({}) doesn't match part no".format(part_no, component['number']))
-                else:
-                    in_stock = component['stock']
-                    footprint = component['package']
-                    price_info = component['price']
-                    if len(price_info) > 0:
-                        # assume that the price info list is sorted by number of parts
-                        price = usd2aud(price_info[0][1])
-                    else:
-                        print(" --Warning, no price info for {}".format(part_no))
-    except Exception as e:
-        print("  Cannot parse response for component {}".format(part_no))
-        print("{}".format(type(e)))
-        print("  Error: {}".format(e))
-        print("  Response: {}".format(res.text))
-        if "Bad Gateway" in res.text:
-            print("Bad gateway, try again in a second")
-            time.sleep(5)
-    time.sleep(0.5)
-    return price, in_stock, footprint
-
-
-def init_lcsc_connection():
-    token, cookies = obtain_csrf_token_and_cookies()
-    headers = {
-        'pragma': 'no-cache',
-        'cache-control': 'no-cache',
-        'accept': 'application/json, text/javascript, */*; q=0.01',
-        'x-csrf-token': token,
-        'x-requested-with': 'XMLHttpRequest',
-        'user-agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.116 Safari/537.36',
-        'isajax': 'true',
-        'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
-        'origin': 'https://lcsc.com',
-        'sec-fetch-site': 'same-origin',
-        'sec-fetch-mode': 'cors',
-        'sec-fetch-dest': 'empty',
-        'referer': 'https://lcsc.com',
-        'accept-language': 'cs,en;q=0.9,sk;q=0.8,en-GB;q=0.7',
-    }
-    return headers, cookies
-
-
-class PartCache:
-    def __init__(self, filename, ttl=None):
-        self.filename = filename
-        self.ttl = ttl
-        shelf = shelve.open(filename)
-        shelf['last_opened'] = datetime.datetime.now()
-        if 'data' not in shelf:
-            shelf['data'] = dict()
-        shelf.close()
-
-    def __getitem__(self, item, default=None):
-        shelf = shelve.open(self.filename)
         try:
-            data = shelf['data'][item]
-            if self.ttl is not None:
-                update_timestamp = data['update_timestamp']
-                if (datetime.datetime.now() - update_timestamp).total_seconds() > self.ttl:
-                    result = default
-                else:
-                    result = data['data']
+            if os.name == 'nt':
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
             else:
-                result = data['data']
-            # print('read item {} from cache, data=<{}>'.format(item, data))
-        except KeyError:
-            result = default
-            # print('item {} not in cache.'.format(item))
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+        else:
+            yield True
+    finally:
+        # closing the file releases the lock
+        f.close()
 
-        shelf.close()
 
-        return result
+def start_background_refresh(max_age_days, part_numbers):
+    """Start a detached process to refresh the stale part_numbers in the part database,
+    so this one (and the KiCad BOM dialog) doesn't have to wait for it"""
+    import subprocess
 
-    def __setitem__(self, key, value):
-        shelf = shelve.open(self.filename)
-        new_data = {
-            'update_timestamp': datetime.datetime.now(),
-            'data': value
-        }
-        existing_data = shelf['data']
-        existing_data[key] = new_data
-        shelf['data'] = existing_data
-        # print('added item {} to cache, data=<{}>'.format(key, new_data))
-        shelf.close()
+    kwargs = dict()
+    if os.name == 'nt':
+        kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), '--refresh-stale', '--max-age', str(max_age_days),
+                      '--parts', ','.join(sorted(part_numbers))],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     **kwargs)
 
 
 def run():
-    check_args()
-    
-    # Override the component equivalence operator - it is important to do this
-    # before loading the netlist, otherwise all components will have the original
-    # equivalency operator.
-    kicad_netlist_reader.comp.__eq__ = myEqu
+    args = parse_args()
+    max_age = args.max_age * 24 * 60 * 60
+
+    # The client only connects to LCSC if a part needs fetching
+    client = None if args.offline else LcscClient()
+
+    if args.refresh_stale:
+        with refresh_lock() as locked:
+            if not locked:
+                # several refreshes at once would just get each other rate limited
+                print('Another refresh is already running')
+                return
+            part_numbers = args.parts.split(',') if args.parts else None
+            with PartDatabase() as part_db, client:
+                refresh_stale_parts(part_db, client, max_age, part_numbers)
+        print(client.stats.summary())
+        return
+
+    import kicad_netlist_reader
 
     # Generate an instance of a generic netlist, and load the netlist tree from
-    # the command line option. If the file doesn't exist, execution will stop
-    net = kicad_netlist_reader.netlist(sys.argv[1])
-    
-    headers, cookies = init_lcsc_connection()
-
-    outfile = get_output_file()
-    generate_bom(net, outfile, headers, cookies)
+    # the command line option. If the file doesn't exist, execution will stop.
+    # The BOM doesn't use the nets, so don't load them.
+    net = kicad_netlist_reader.netlist(args.netlist, sections=BOM_NETLIST_SECTIONS)
+
+    footprint_libraries = project_footprint_libraries(args.netlist, args.fp_lib_table, args.footprint_dir)
+    symbol_filters = load_symbol_filters(args.symbol_lib)
+
+    outfile = get_output_file(args.output)
+    rates = ExchangeRates(offline=args.offline)
+    with PartDatabase() as part_db, client or contextlib.nullcontext():
+        stale = generate_bom(net, outfile, part_db, client, rates, args.currency, max_age, args.refresh,
+                             args.boards, args.cheapest_order, footprint_libraries, symbol_filters)
+        print(part_db.cache_summary())
     outfile.close()
+    if client is not None:
+        print(client.stats.summary())
+
+    if stale and not args.offline and not args.no_background_refresh:
+        print('Refreshing stale prices in the background')
+        start_background_refresh(args.max_age, stale)
     
 
 if __name__ == '__main__':
@@ -0,0 +1,139 @@
+"""
+    @package
+    Currency conversion for LCSC prices (which are in USD), shared by the priced
+    BOM plugin and the library updater.
+
+    Exchange rates are fetched from an exchangeratesapi.io style API and cached in
+    a JSON file in the temp directory, so most runs never touch the network. The
+    API address can be changed with the EXCHANGE_RATE_URL environment variable,
+    e.g. to point it at a local stand-in server for testing.
+
+    Example:
+        rates = ExchangeRates()
+        aud_breaks = rates.convert_breaks(part.price_breaks, 'AUD')
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+rates_url = os.environ.get('EXCHANGE_RATE_URL', 'https://api.exchangeratesapi.io/latest')
+default_cache_filename = os.path.join(tempfile.gettempdir(), 'lcsc_exchange_rates.json')
+default_currency = 'AUD'
+# how long a cached rate is used for before it is fetched again, in seconds
+default_ttl = 24 * 60 * 60
+
+
+class ExchangeRates:
+    """Exchange rates between currencies, cached in cache_filename.
+
+    Rates are fetched from url when they are first needed, and fetched again once
+    they are more than ttl seconds old. If a rate can't be fetched (or offline is
+    set) the cached rate is used however old it is, and if there is no cached rate
+    the conversions return None. A rate which couldn't be fetched isn't tried again
+    by the same ExchangeRates.
+    """
+
+    def __init__(self, cache_filename=default_cache_filename, ttl=default_ttl, url=None, timeout=5,
+                 offline=False):
+        self.cache_filename = cache_filename
+        self.ttl = ttl
+        self.url = url or rates_url
+        self.timeout = timeout
+        self.offline = offline
+        self._cache = None
+        self._failed = set()
+        self._warned = set()
+        self._lock = threading.Lock()
+
+    def rate(self, currency, base='USD'):
+        """Return how many currency one base is worth, or None if it isn't known"""
+        if currency == base:
+            return 1.0
+        key = '{}/{}'.format(base, currency)
+        with self._lock:
+            cache = self._load_cache()
+            cached = cache.get(key)
+            if cached is not None and (self.offline or time.time() - cached['fetched_at'] <= self.ttl):
+                return cached['rate']
+
+            rate = None
+            if not self.offline and key not in self._failed:
+                rate = self._fetch(currency, base)
+                if rate is None:
+                    # don't hold every conversion up trying again
+                    self._failed.add(key)
+            if rate is not None:
+                cache[key] = {'rate': rate, 'fetched_at': time.time()}
+                self._save_cache()
+                return rate
+            if cached is not None:
+                self._warn(key, ' --Warning: using the exchange rate for {} from {}'.format(
+                    key, time.strftime('%Y-%m-%d', time.localtime(cached['fetched_at']))))
+                return cached['rate']
+            self._warn(key, ' --Warning: no exchange rate for {}, prices will be missing'.format(key))
+            return None
+
+    def convert(self, amount, currency, base='USD'):
+        rate = self.rate(currency, base)
+        if rate is None or amount is None:
+            return None
+        return amount * rate
+
+    def convert_breaks(self, price_breaks, currency, base='USD'):
+        """Convert a price break table ([[quantity, unit price], ...]) to currency, or
+        return None if the rate isn't known"""
+        return self.convert_tables({None: price_breaks}, currency, base)[None]
+
+    def convert_tables(self, tables, currency, base='USD'):
+        """Convert a dict of price break tables to currency, looking the rate up once for
+        all of them (and not at all if there are no tables). The tables are None if the
+        rate isn't known"""
+        if not tables:
+            return dict()
+        rate = self.rate(currency, base)
+        if rate is None:
+            return {key: None for key in tables}
+        return {key: [[quantity, price * rate] for quantity, price in price_breaks]
+                for key, price_breaks in tables.items()}
+
+    def _fetch(self, currency, base):
+        # only import requests when a rate isn't cached, see lcsc_client
+        import requests
+
+        try:
+            res = requests.get(self.url, params={'base': base, 'symbols': currency}, timeout=self.timeout)
+            data = res.json()
+            rates = dict(data['rates'])
+            rates[data.get('base', base)] = 1.0
+            # a rates API (or stand-in) may ignore the base asked for, so work out the
+            # rate between the two currencies from whatever base it used
+            return float(rates[currency]) / float(rates[base])
+        except (requests.RequestException, ValueError, KeyError, TypeError, ZeroDivisionError) as e:
+            print(' --Warning: could not fetch the {}/{} exchange rate: {}'.format(base, currency, e))
+            return None
+
+    def _load_cache(self):
+        if self._cache is None:
+            try:
+                with open(self.cache_filename, 'r') as f:
+                    self._cache = json.load(f)
+            except (OSError, ValueError):
+                self._cache = dict()
+        return self._cache
+
+    def _save_cache(self):
+        tmp_filename = '{}.{}.tmp'.format(self.cache_filename, os.getpid())
+        try:
+            with open(tmp_filename, 'w') as f:
+                json.dump(self._cache, f)
+            os.replace(tmp_filename, self.cache_filename)
+        except OSError as e:
+            print(' --Warning: could not save the exchange rates to {}: {}'.format(self.cache_filename, e))
+
+    def _warn(self, key, message):
+        if key not in self._warned:
+            self._warned.add(key)
+            print(message)
@@ -1,5 +1,9 @@
 
 
+import heapq
+import itertools
+import time
+from collections import OrderedDict
 from collections.abc import MutableMapping
 
 
@@ -32,6 +36,9 @@ class Cache(MutableMapping):
         self.__data = dict()
         self.__currsize = 0
         self.__maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def __repr__(self):
         return '%s(%r, maxsize=%r, currsize=%r)' % (
@@ -43,9 +50,12 @@ class Cache(MutableMapping):
 
     def __getitem__(self, key):
         try:
-            return self.__data[key]
+            value = self.__data[key]
         except KeyError:
+            self.misses += 1
             return self.__missing__(key)
+        self.hits += 1
+        return value
 
     def __setitem__(self, key, value):
         maxsize = self.__maxsize
@@ -55,6 +65,7 @@ class Cache(MutableMapping):
         if key not in self.__data or self.__size[key] < size:
             while self.__currsize + size > maxsize:
                 self.popitem()
+                self.evictions += 1
         if key in self.__data:
             diffsize = size - self.__size[key]
         else:
@@ -84,11 +95,12 @@ class Cache(MutableMapping):
         if key in self:
             return self[key]
         else:
+            self.misses += 1
             return default
 
     def pop(self, key, default=__marker):
         if key in self:
-            value = self[key]
+            value = self.__data[key]
             del self[key]
         elif default is self.__marker:
             raise KeyError(key)
@@ -118,10 +130,149 @@ class Cache(MutableMapping):
         """Return the size of a cache element's value."""
         return 1
 
+    def stats(self):
+        """Return a dict of the cache's hit, miss and eviction counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'currsize': self.currsize,
+            'maxsize': self.maxsize,
+        }
+
+
+class LruCache(Cache):
+    """Least Recently Used (LRU) cache implementation."""
+
+    def __init__(self, maxsize, getsizeof=None):
+        super().__init__(maxsize, getsizeof)
+        self.__order = OrderedDict()
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if key in self.__order:  # __missing__ may not store item
+            self.__order.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        try:
+            self.__order.move_to_end(key)
+        except KeyError:
+            self.__order[key] = None
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        del self.__order[key]
+
+    def popitem(self):
+        """Remove and return the `(key, value)` pair least recently used."""
+        try:
+            key = next(iter(self.__order))
+        except StopIteration:
+            raise KeyError('%s is empty' % self.__class__.__name__) from None
+        return (key, self.pop(key))
+
 
 class TtlCache(Cache):
-    pass
+    """Cache implementation with per-item time-to-live (TTL) value.
 
+    Items expire ttl seconds after they were last set. Expired items are swept
+    lazily from a heap ordered by expiry time, whenever the cache is modified,
+    sized or iterated. When the cache is full, the item closest to expiring is
+    evicted.
+    """
 
-class LruCache(Cache):
-    pass
\ No newline at end of file
+    def __init__(self, maxsize, ttl, timer=time.monotonic, getsizeof=None):
+        super().__init__(maxsize, getsizeof)
+        self.__ttl = ttl
+        self.__timer = timer
+        self.__expires = dict()
+        self.__heap = []
+        self.__counter = itertools.count()
+        self.expirations = 0
+
+    def __contains__(self, key):
+        if not super().__contains__(key):
+            return False
+        return self.__expires[key] > self.__timer()
+
+    def __getitem__(self, key):
+        expires = self.__expires.get(key)
+        if expires is not None and expires <= self.__timer():
+            self.__expire_key(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self.expire()
+        super().__setitem__(key, value)
+        expires = self.__timer() + self.__ttl
+        self.__expires[key] = expires
+        heapq.heappush(self.__heap, (expires, next(self.__counter), key))
+        if len(self.__heap) > 2 * len(self.__expires) + 16:
+            # drop the stale entries left behind by items which were set again
+            self.__heap = [(e, next(self.__counter), k) for k, e in self.__expires.items()]
+            heapq.heapify(self.__heap)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        del self.__expires[key]
+
+    def __iter__(self):
+        self.expire()
+        return super().__iter__()
+
+    def __len__(self):
+        self.expire()
+        return super().__len__()
+
+    @property
+    def ttl(self):
+        """The time-to-live value of the cache's items."""
+        return self.__ttl
+
+    @property
+    def timer(self):
+        """The timer function used by the cache."""
+        return self.__timer
+
+    def expire(self, time=None):
+        """Remove expired items from the cache."""
+        if time is None:
+            time = self.__timer()
+        heap = self.__heap
+        while heap and heap[0][0] <= time:
+            expires, _, key = heapq.heappop(heap)
+            # entries for items which have since been set again or deleted are stale
+            if self.__expires.get(key) == expires:
+                self.__expire_key(key)
+
+    def popitem(self):
+        """Remove and return the `(key, value)` pair closest to expiring."""
+        self.expire()
+        heap = self.__heap
+        while heap:
+            expires, _, key = heapq.heappop(heap)
+            if self.__expires.get(key) == expires:
+                return (key, self.pop(key))
+        raise KeyError('%s is empty' % self.__class__.__name__)
+
+    def stats(self):
+        stats = super().stats()
+        stats['expirations'] = self.expirations
+        return stats
+
+    def __expire_key(self, key):
+        super().__delitem__(key)
+        del self.__expires[key]
+        self.expirations += 1
+
+
+class TtlLruCache(TtlCache, LruCache):
+    """Cache with a per-item time-to-live which, when full, evicts the least
+    recently used item rather than the one closest to expiring."""
+
+    def popitem(self):
+        """Remove and return the `(key, value)` pair least recently used."""
+        self.expire()
+        return LruCache.popitem(self)
\ No newline at end of file
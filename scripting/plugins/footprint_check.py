@@ -0,0 +1,213 @@
+"""
+    @package
+    Checks of the footprints assigned to a netlist's components, for the BOM
+    plugins.
+
+    Each component's footprint is checked against the footprint libraries (see
+    kicad_footprint.FootprintLibraries) and against its symbol's footprint
+    filters ($FPLIST): wildcards like R_* or SOIC*3.9x4.9mm*, matched the way
+    KiCad matches them, without case and against just the footprint name unless
+    the filter has a library name in it.
+
+    The libraries are the ones in the project's fp-lib-table and in the user's
+    global one, as KiCad finds them. Footprints in a library neither table defines
+    aren't flagged, since it may be in a table that couldn't be found. The
+    libraries' indexes are cached in the temp directory, so checking a netlist
+    doesn't write anything into the library folders.
+
+    Components are checked in one pass: the filters of each symbol are compiled
+    into a single regex the first time they're seen, and each distinct
+    (filters, footprint) pair and each distinct footprint is only checked once,
+    however many components share it.
+
+    Example:
+        libraries = project_footprint_libraries('board.xml')
+        problems = check_footprints(net.getInterestingComponents(), libraries)
+        report_footprint_problems(problems)
+"""
+
+import os
+import re
+import sys
+
+# The footprint libraries of a project are in the fp-lib-table next to it, and the
+# user's global ones are in the fp-lib-table in KiCad's config directory
+LIB_TABLE_FILENAME = 'fp-lib-table'
+
+_config_version_re = re.compile(r'\d+(\.\d+)*\Z')
+
+
+def _glob_to_regex(pattern):
+    """Translate a KiCad footprint filter into a regex to match against a whole
+    "library:footprint" id. A filter without a library name matches the footprint
+    name, in any library"""
+    if ':' in pattern:
+        any_chars, any_char, prefix = '.*', '.', ''
+    else:
+        any_chars, any_char, prefix = '[^:]*', '[^:]', '(?:.*:)?'
+    parts = []
+    for c in pattern:
+        if c == '*':
+            parts.append(any_chars)
+        elif c == '?':
+            parts.append(any_char)
+        else:
+            parts.append(re.escape(c))
+    return prefix + ''.join(parts)
+
+
+class FootprintFilters:
+    """Matchers for sets of footprint filters, each compiled once into a single regex"""
+
+    def __init__(self):
+        self._matchers = dict()
+
+    def matcher(self, filters):
+        """Return a compiled regex matching the footprint ids any of filters match, or
+        None if there are no filters (which allow any footprint)"""
+        filters = tuple(filters)
+        if not filters:
+            return None
+        if filters not in self._matchers:
+            self._matchers[filters] = re.compile(
+                '(?:{})\\Z'.format('|'.join(_glob_to_regex(f) for f in filters)), re.IGNORECASE)
+        return self._matchers[filters]
+
+    def matches(self, filters, lib_id):
+        matcher = self.matcher(filters)
+        return matcher is None or matcher.match(lib_id) is not None
+
+
+def load_symbol_filters(lib_files):
+    """Return {(library nickname, symbol name): footprint filters} for the symbols (and
+    their aliases) in .lib files, taking each library's nickname from its file name"""
+    from kicad_symbol_lib import SymbolLibrary
+
+    symbol_filters = dict()
+    for lib_file in lib_files:
+        nickname = os.path.splitext(os.path.basename(lib_file))[0]
+        for symbol in SymbolLibrary.load(lib_file):
+            fplist = tuple(symbol.fplist)
+            for name in [symbol.name] + symbol.aliases:
+                symbol_filters[nickname, name] = fplist
+    return symbol_filters
+
+
+def global_lib_table():
+    """Return the user's global fp-lib-table, or None if it can't be found. It is in
+    KiCad's config directory (KICAD_CONFIG_HOME, if that is set), in a subdirectory
+    for each version since KiCad 6; the newest version's is used"""
+    config_dir = os.environ.get('KICAD_CONFIG_HOME')
+    if not config_dir:
+        if sys.platform == 'win32':
+            config_dir = os.path.join(os.environ.get('APPDATA', ''), 'kicad')
+        elif sys.platform == 'darwin':
+            config_dir = os.path.expanduser('~/Library/Preferences/kicad')
+        else:
+            config_dir = os.path.join(os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config'), 'kicad')
+    try:
+        versions = [name for name in os.listdir(config_dir) if _config_version_re.match(name)]
+    except OSError:
+        return None
+    versions.sort(key=lambda version: [int(number) for number in version.split('.')], reverse=True)
+    for directory in [os.path.join(config_dir, version) for version in versions] + [config_dir]:
+        filename = os.path.join(directory, LIB_TABLE_FILENAME)
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+
+def project_footprint_libraries(netlist_filename, lib_table=None, directories=None):
+    """Return the FootprintLibraries to check a netlist's footprints against: the
+    libraries in the user's global fp-lib-table, overridden by the ones in lib_table,
+    or else the project's fp-lib-table next to the netlist, plus the .pretty
+    directories in directories (or directly inside them). Libraries whose paths use
+    variables that aren't set are left out. Returns None if there are no libraries"""
+    from kicad_footprint import FootprintLibraries, FootprintLibrary
+
+    project_dir = os.path.dirname(os.path.abspath(netlist_filename))
+    if lib_table is None:
+        lib_table = os.path.join(project_dir, LIB_TABLE_FILENAME)
+        if not os.path.exists(lib_table):
+            lib_table = None
+    library_dirs = dict()
+    for table in [global_lib_table(), lib_table]:
+        if table is not None:
+            library_dirs.update(FootprintLibraries.from_lib_table(table, {'KIPRJMOD': project_dir}).directories)
+    library_dirs = {name: directory for name, directory in library_dirs.items() if '${' not in directory}
+    for directory in directories or []:
+        if directory.rstrip('/\\').endswith('.pretty'):
+            pretty_dirs = [directory]
+        else:
+            pretty_dirs = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                                 if name.endswith('.pretty'))
+        for pretty_dir in pretty_dirs:
+            library_dirs.setdefault(FootprintLibrary(pretty_dir).name, pretty_dir)
+    if not library_dirs:
+        return None
+    return FootprintLibraries(library_dirs, index_beside=False)
+
+
+def check_footprints(components, libraries=None, symbol_filters=None, filters=None):
+    """Check the footprints of components (kicad_netlist_reader comps). Footprints are
+    looked up in libraries if they're given (skipping the ones in libraries it doesn't
+    have), and checked against the filters in
+    symbol_filters (see load_symbol_filters()), or the filters in the netlist for the
+    symbols which aren't in it.
+
+    Returns a list of (references, footprint, problem) for each problem, where
+    references is the list of the references of the components with that problem.
+    """
+    filters = filters or FootprintFilters()
+    symbol_filters = symbol_filters or dict()
+
+    # group the components by what needs checking, so each check is done once
+    by_footprint = dict()
+    by_filters = dict()
+    no_footprint = []
+    for component in components:
+        lib_id = component.getFootprint()
+        if lib_id == '':
+            no_footprint.append(component.getRef())
+            continue
+        by_footprint.setdefault(lib_id, []).append(component)
+        key = (component.getLibName(), component.getPartName())
+        symbol_fplist = symbol_filters.get(key)
+        if symbol_fplist is None:
+            libpart = component.getLibPart()
+            symbol_fplist = tuple(libpart.getFootprintFilters()) if libpart else ()
+        if symbol_fplist:
+            by_filters.setdefault((symbol_fplist, lib_id), []).append(component.getRef())
+
+    problems = []
+    if no_footprint:
+        problems.append((no_footprint, '', 'no footprint'))
+
+    if libraries is not None:
+        for lib_id, group in sorted(by_footprint.items()):
+            library = libraries.split_id(lib_id)[0]
+            if ':' not in lib_id:
+                problem = 'no footprint library in {}'.format(lib_id)
+            elif library not in libraries.directories or lib_id in libraries:
+                continue
+            elif libraries.index(library) is None:
+                problem = 'footprint library {} not found'.format(library)
+            else:
+                problem = 'footprint {} not found'.format(lib_id)
+            problems.append(([component.getRef() for component in group], lib_id, problem))
+
+    for (symbol_fplist, lib_id), refs in sorted(by_filters.items(), key=lambda item: item[0][1]):
+        if not filters.matches(symbol_fplist, lib_id):
+            problems.append((refs, lib_id, 'footprint {} does not match the symbol footprint filters {}'.format(
+                lib_id, ' '.join(symbol_fplist))))
+    return problems
+
+
+def report_footprint_problems(problems, max_refs=10):
+    """Print a warning for each problem found by check_footprints(), listing up to
+    max_refs of the components with it"""
+    for refs, _, problem in problems:
+        shown = ', '.join(refs[:max_refs])
+        if len(refs) > max_refs:
+            shown += ' and {} more'.format(len(refs) - max_refs)
+        print('Warning components {}: {}'.format(shown, problem))
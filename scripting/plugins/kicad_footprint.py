@@ -0,0 +1,927 @@
+"""
+    @package
+    Reader/writer for KiCad footprints (.kicad_mod files, in both the KiCad 5
+    "(module ..." and the KiCad 6+ "(footprint ..." formats) and footprint
+    libraries (.pretty directories).
+
+    A footprint is an s-expression, which is parsed in one regex pass into a tree
+    of SExpr lists. Each list keeps the whitespace in front of each of its items,
+    and atoms are kept as the exact text of their token, so dumps() gives back
+    exactly the text that was parsed, and editing one value only changes that
+    token. Lists laid out the usual way on one line, like (at 0 4), don't store
+    their whitespace at all, which keeps the tree small.
+
+    Footprint, Pad, FpText, FpLine, FpCircle and FpPoly are thin views over the
+    tree giving the common parts of a footprint as Python values.
+
+    Example:
+        footprint = Footprint.load('matt_lib.pretty/L_14.4x12.8mm_H6.5mm.kicad_mod')
+        for pad in footprint.pads:
+            print(pad.number, pad.type, pad.at, pad.size, pad.layers)
+        footprint.value.text = 'L_14.4x12.8mm'
+        footprint.save('matt_lib.pretty/L_14.4x12.8mm_H6.5mm.kicad_mod')
+
+        lib = FootprintLibrary('user-footprints/matt_lib.pretty')
+        print(lib.names, lib['L_14.4x12.8mm_H6.5mm'].bounding_box())
+
+    FootprintIndex caches a summary of each footprint in a library (pad count,
+    layers, bounding box), so looking footprints up doesn't mean parsing every
+    file, and FootprintLibraries looks them up across libraries by KiCad's
+    "library:footprint" ids:
+        libraries = FootprintLibraries.from_directories(glob.glob('user-footprints/*.pretty'))
+        'matt_lib:L_14.4x12.8mm_H6.5mm' in libraries  # True
+        libraries.with_pad_count(16)                   # ['matt_lib:SOT763-1(DHVQFN16)']
+"""
+
+import gc
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+
+from kicad_symbol_lib import atomic_write, quote, unquote
+
+FOOTPRINT_EXTENSION = '.kicad_mod'
+
+# whitespace, then a bracket, a quoted string or an atom
+_token_re = re.compile(r'(\s*)([^\s()"]+|[()]|"[^"\\]*(?:\\.[^"\\]*)*")')
+_needs_quotes_re = re.compile(r'[\s()"\\]|^$')
+
+
+def _atom(value, quoted=False):
+    """Return the token for value. Strings are quoted if quoted is set or they need to
+    be, and numbers are written the way KiCad writes them"""
+    if isinstance(value, float):
+        value = '{:.6f}'.format(value).rstrip('0').rstrip('.')
+        return '0' if value == '-0' else value
+    value = str(value)
+    if quoted or _needs_quotes_re.search(value):
+        return quote(value)
+    return value
+
+
+class SExpr:
+    """A list in an s-expression: (name item item ...).
+
+    items holds the atoms, as the text of their tokens, and the SExpr sub-lists.
+    spaces holds the whitespace in front of each item and then the whitespace in
+    front of the closing bracket, or is None if that is the plain layout: nothing
+    after the opening bracket or before the closing one, and single spaces between
+    the items.
+    """
+
+    __slots__ = ('items', 'spaces')
+
+    def __init__(self, items, spaces=None):
+        self.items = items
+        self.spaces = spaces
+
+    @property
+    def name(self):
+        if self.items and self.items[0].__class__ is str:
+            return self.items[0]
+        return None
+
+    def __iter__(self):
+        """The SExpr sub-lists"""
+        for item in self.items:
+            if item.__class__ is not str:
+                yield item
+
+    def children(self, *names):
+        """The SExpr sub-lists whose name is one of names"""
+        return [item for item in self.items if item.__class__ is not str and item.items and item.items[0] in names]
+
+    def child(self, name):
+        """The first SExpr sub-list called name, or None"""
+        for item in self.items:
+            if item.__class__ is not str and item.items and item.items[0] == name:
+                return item
+        return None
+
+    @property
+    def values(self):
+        """The unquoted atoms after the name"""
+        return [unquote(item) for item in self.items[1:] if item.__class__ is str]
+
+    def value(self, index=0, default=None):
+        """The index-th unquoted atom after the name, or default if there isn't one"""
+        atoms = [item for item in self.items[1:] if item.__class__ is str]
+        if index < len(atoms):
+            return unquote(atoms[index])
+        return default
+
+    def set_value(self, index, value):
+        """Set the index-th atom after the name, keeping its quoting and the whitespace
+        around it. An atom can be added on the end, but not further past it"""
+        positions = [i for i, item in enumerate(self.items) if i and item.__class__ is str]
+        if index < len(positions):
+            i = positions[index]
+            self.items[i] = _atom(value, self.items[i][:1] == '"')
+        elif index == len(positions):
+            self.insert(positions[-1] + 1 if positions else 1, _atom(value))
+        else:
+            raise IndexError('can only add the atom after the last one')
+
+    def set_values(self, values):
+        """Replace the atoms after the name with values, keeping the whitespace in
+        front of the ones that are still there"""
+        positions = [i for i, item in enumerate(self.items) if i and item.__class__ is str]
+        for index, value in enumerate(values):
+            self.set_value(index, value)
+        for i in reversed(positions[len(values):]):
+            self.remove(self.items[i])
+
+    def insert(self, index, item, space=' '):
+        """Insert an atom or SExpr at index in items, with space in front of it"""
+        if self.spaces is None and (space != ' ' or index == 0):
+            self.spaces = [''] + [' '] * (len(self.items) - 1) + ['']
+        if self.spaces is not None:
+            self.spaces.insert(index, space)
+        self.items.insert(index, item)
+
+    def append(self, item, space=' '):
+        self.insert(len(self.items), item, space)
+
+    def remove(self, item):
+        """Remove an item, and the whitespace in front of it"""
+        for i, x in enumerate(self.items):
+            if x is item:
+                del self.items[i]
+                if self.spaces is not None:
+                    del self.spaces[i]
+                return
+        raise ValueError('item not in the list')
+
+    def dumps(self):
+        out = []
+        _dump(self, out)
+        return ''.join(out)
+
+    def __repr__(self):
+        return 'SExpr({!r})'.format(self.name)
+
+
+def _dump(node, out):
+    spaces = node.spaces
+    out.append('(')
+    if spaces is None:
+        first = True
+        for item in node.items:
+            if first:
+                first = False
+            else:
+                out.append(' ')
+            if item.__class__ is str:
+                out.append(item)
+            else:
+                _dump(item, out)
+    else:
+        for space, item in zip(spaces, node.items):
+            out.append(space)
+            if item.__class__ is str:
+                out.append(item)
+            else:
+                _dump(item, out)
+        out.append(spaces[-1])
+    out.append(')')
+
+
+def parse_sexpr(text):
+    """Parse the s-expression in text. Returns the whitespace before it, the SExpr, and
+    the whitespace after it"""
+    # the tree has no reference cycles, so there is nothing for the garbage collector
+    # to find while it is built, but lots of new objects to set it off looking
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _parse_sexpr(text)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _parse_sexpr(text):
+    stack = []
+    items = spaces = None
+    root = None
+    leading = ''
+    tokens = iter(_token_re.findall(text))
+    for space, token in tokens:
+        if token == '(':
+            if items is None:
+                leading = space
+            else:
+                spaces.append(space)
+                stack.append((items, spaces))
+            items = []
+            spaces = []
+        elif token == ')':
+            if items is None:
+                raise ValueError('unbalanced )')
+            # don't keep the whitespace of a list laid out the plain way
+            if space or (spaces and spaces[0]) or spaces.count(' ') != len(spaces) - 1:
+                spaces.append(space)
+            else:
+                spaces = None
+            node = SExpr(items, spaces)
+            if not stack:
+                root = node
+                break
+            items, spaces = stack.pop()
+            items.append(node)
+        elif items is None:
+            raise ValueError('atom {} outside the s-expression'.format(token))
+        else:
+            spaces.append(space)
+            items.append(token)
+    if root is None:
+        raise ValueError('unterminated s-expression' if items is not None else 'no s-expression')
+    for space, token in tokens:
+        raise ValueError('{} after the end of the s-expression'.format(token))
+    trailing = text[len(text.rstrip()):]
+    # the tokens skip over anything they don't match, like an unterminated string
+    if _token_re.sub('', text).strip():
+        raise ValueError('could not parse {!r}'.format(_token_re.sub('', text).strip()[:20]))
+    return leading, root, trailing
+
+
+def _xy(node):
+    """The (x, y) of a node like (start 1.5 -2)"""
+    if node is None:
+        return None
+    return float(node.items[1]), float(node.items[2])
+
+
+class _Item:
+    """A view over the SExpr of one item of a footprint"""
+
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        self.node = node
+
+    def _get(self, name, default=None):
+        child = self.node.child(name)
+        if child is None:
+            return default
+        return child.value(0, default)
+
+    def _set(self, name, values):
+        child = self.node.child(name)
+        if child is None:
+            self.node.append(SExpr([name] + [_atom(v) for v in values]))
+        else:
+            child.set_values(values)
+
+    @property
+    def layer(self):
+        return self._get('layer')
+
+    @layer.setter
+    def layer(self, layer):
+        self._set('layer', [layer])
+
+    @property
+    def layers(self):
+        """The layers the item is on"""
+        layer = self.layer
+        return [layer] if layer is not None else []
+
+    def _width(self):
+        width = self._get('width')
+        if width is None:
+            # KiCad 6+ puts the width in (stroke (width 0.12) (type solid))
+            stroke = self.node.child('stroke')
+            if stroke is not None:
+                width = stroke.child('width')
+                width = width.value() if width is not None else None
+        return float(width) if width is not None else None
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ' '.join(self.node.values))
+
+
+class _Positioned(_Item):
+    __slots__ = ()
+
+    @property
+    def at(self):
+        """(x, y, angle), with the angle 0 if it isn't given"""
+        at = self.node.child('at')
+        if at is None:
+            return None
+        values = at.values
+        return float(values[0]), float(values[1]), float(values[2]) if len(values) > 2 and values[2] != 'unlocked' else 0.0
+
+    @at.setter
+    def at(self, at):
+        x, y = at[:2]
+        angle = at[2] if len(at) > 2 else 0
+        self._set('at', [float(x), float(y)] + ([float(angle)] if angle else []))
+
+
+class Pad(_Positioned):
+    """(pad <number> <type> <shape> (at ..) (size ..) [(drill ..)] (layers ..) ...)"""
+
+    __slots__ = ()
+
+    @property
+    def number(self):
+        return self.node.value(0)
+
+    @number.setter
+    def number(self, number):
+        self.node.set_value(0, number)
+
+    @property
+    def type(self):
+        """thru_hole, smd, connect or np_thru_hole"""
+        return self.node.value(1)
+
+    @property
+    def shape(self):
+        """circle, rect, oval, trapezoid, roundrect or custom"""
+        return self.node.value(2)
+
+    @property
+    def size(self):
+        return _xy(self.node.child('size'))
+
+    @size.setter
+    def size(self, size):
+        self._set('size', [float(size[0]), float(size[1])])
+
+    @property
+    def drill(self):
+        """The drill diameter, or the (width, height) of an oval drill, or None"""
+        drill = self.node.child('drill')
+        if drill is None:
+            return None
+        values = [v for v in drill.values if v != 'oval']
+        if not values:
+            return None
+        if len(values) > 1:
+            return float(values[0]), float(values[1])
+        return float(values[0])
+
+    @property
+    def layers(self):
+        layers = self.node.child('layers')
+        return layers.values if layers is not None else []
+
+    @layers.setter
+    def layers(self, layers):
+        self._set('layers', list(layers))
+
+    @property
+    def is_plated(self):
+        return self.type != 'np_thru_hole'
+
+    def corners(self):
+        """The corners of the pad's bounding rectangle (ignoring any custom shape),
+        rotated to the pad's angle, relative to the footprint's origin"""
+        x, y, angle = self.at
+        w, h = self.size
+        return _rotated([(-w / 2, -h / 2), (w / 2, -h / 2), (w / 2, h / 2), (-w / 2, h / 2)], angle, x, y)
+
+
+class FpText(_Positioned):
+    """(fp_text <reference|value|user> <text> (at ..) (layer ..) [hide] (effects ..))"""
+
+    __slots__ = ()
+
+    @property
+    def kind(self):
+        return self.node.value(0)
+
+    @property
+    def text(self):
+        return self.node.value(1)
+
+    @text.setter
+    def text(self, text):
+        self.node.set_value(1, text)
+
+    @property
+    def hidden(self):
+        if 'hide' in self.node.items[3:]:
+            return True
+        # KiCad 6+ can write (hide yes)
+        hide = self.node.child('hide')
+        return hide is not None and hide.value() != 'no'
+
+
+class FpLine(_Item):
+    """(fp_line (start ..) (end ..) (layer ..) (width ..))"""
+
+    __slots__ = ()
+
+    @property
+    def start(self):
+        return _xy(self.node.child('start'))
+
+    @start.setter
+    def start(self, start):
+        self._set('start', [float(start[0]), float(start[1])])
+
+    @property
+    def end(self):
+        return _xy(self.node.child('end'))
+
+    @end.setter
+    def end(self, end):
+        self._set('end', [float(end[0]), float(end[1])])
+
+    @property
+    def width(self):
+        return self._width()
+
+    def points(self):
+        return [self.start, self.end]
+
+
+class FpCircle(_Item):
+    """(fp_circle (center ..) (end ..) (layer ..) (width ..)), where end is a point on
+    the circle"""
+
+    __slots__ = ()
+
+    @property
+    def center(self):
+        return _xy(self.node.child('center'))
+
+    @property
+    def end(self):
+        return _xy(self.node.child('end'))
+
+    @property
+    def radius(self):
+        (cx, cy), (ex, ey) = self.center, self.end
+        return math.hypot(ex - cx, ey - cy)
+
+    @property
+    def width(self):
+        return self._width()
+
+    def points(self):
+        (x, y), r = self.center, self.radius
+        return [(x - r, y - r), (x + r, y + r)]
+
+
+class FpPoly(_Item):
+    """(fp_poly (pts (xy ..) (xy ..) ...) (layer ..) (width ..))"""
+
+    __slots__ = ()
+
+    @property
+    def width(self):
+        return self._width()
+
+    def points(self):
+        pts = self.node.child('pts')
+        if pts is None:
+            return []
+        return [_xy(xy) for xy in pts.children('xy')]
+
+
+def _rotated(points, angle, dx=0.0, dy=0.0):
+    """Rotate points by angle degrees (anticlockwise on the board, which has y down)
+    and move them by dx, dy"""
+    if not angle:
+        return [(x + dx, y + dy) for x, y in points]
+    a = math.radians(angle)
+    c, s = math.cos(a), math.sin(a)
+    return [(x * c + y * s + dx, -x * s + y * c + dy) for x, y in points]
+
+
+_graphic_types = {'fp_line': FpLine, 'fp_circle': FpCircle, 'fp_poly': FpPoly}
+
+
+class Footprint:
+    """A footprint: the SExpr tree of a .kicad_mod file, with the whitespace around it"""
+
+    __slots__ = ('root', 'leading', 'trailing')
+
+    def __init__(self, root, leading='', trailing='\n'):
+        if root.name not in ('module', 'footprint'):
+            raise ValueError('not a footprint: ({} ...)'.format(root.name))
+        self.root = root
+        self.leading = leading
+        self.trailing = trailing
+
+    @classmethod
+    def parse(cls, text):
+        leading, root, trailing = parse_sexpr(text)
+        return cls(root, leading, trailing)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r', encoding='utf-8', newline='') as f:
+            return cls.parse(f.read())
+
+    def dumps(self):
+        return self.leading + self.root.dumps() + self.trailing
+
+    def save(self, filename):
+        with atomic_write(filename, 'w', encoding='utf-8', newline='') as f:
+            f.write(self.dumps())
+
+    @property
+    def name(self):
+        return self.root.value(0)
+
+    @name.setter
+    def name(self, name):
+        self.root.set_value(0, name)
+
+    def _get(self, name):
+        child = self.root.child(name)
+        return child.value() if child is not None else None
+
+    @property
+    def layer(self):
+        return self._get('layer')
+
+    @property
+    def descr(self):
+        return self._get('descr')
+
+    @property
+    def tags(self):
+        return self._get('tags')
+
+    @property
+    def attr(self):
+        """The attributes, e.g. ['smd'] or ['virtual']"""
+        attr = self.root.child('attr')
+        return attr.values if attr is not None else []
+
+    @property
+    def pads(self):
+        return [Pad(node) for node in self.root.children('pad')]
+
+    @property
+    def texts(self):
+        return [FpText(node) for node in self.root.children('fp_text')]
+
+    def text(self, kind):
+        """The first fp_text of kind (reference, value or user), or None"""
+        for text in self.texts:
+            if text.kind == kind:
+                return text
+        return None
+
+    @property
+    def reference(self):
+        return self.text('reference')
+
+    @property
+    def value(self):
+        return self.text('value')
+
+    @property
+    def lines(self):
+        return [FpLine(node) for node in self.root.children('fp_line')]
+
+    @property
+    def circles(self):
+        return [FpCircle(node) for node in self.root.children('fp_circle')]
+
+    @property
+    def polys(self):
+        return [FpPoly(node) for node in self.root.children('fp_poly')]
+
+    @property
+    def graphics(self):
+        """The fp_lines, fp_circles and fp_polys, in file order"""
+        return [_graphic_types[node.items[0]](node) for node in self.root.children(*_graphic_types)]
+
+    @property
+    def layers(self):
+        """The set of layers used by the footprint's pads, texts and graphics"""
+        layers = set()
+        for item in self.pads + self.texts + self.graphics:
+            layers.update(item.layers)
+        return layers
+
+    def bounding_box(self, layers=None):
+        """(min x, min y, max x, max y) around the pads and graphics (on layers, if
+        given), or None if there are none. Line widths are ignored"""
+        points = []
+        for pad in self.pads:
+            if layers is None or not layers.isdisjoint(pad.layers):
+                points.extend(pad.corners())
+        for graphic in self.graphics:
+            if layers is None or graphic.layer in layers:
+                points.extend(graphic.points())
+        if not points:
+            return None
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def __repr__(self):
+        return 'Footprint({!r})'.format(self.name)
+
+
+class FootprintLibrary:
+    """A .pretty directory of footprints. Footprints are loaded when they are first
+    asked for, by name (the file name without .kicad_mod)"""
+
+    __slots__ = ('directory', '_footprints')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._footprints = dict()
+
+    @property
+    def name(self):
+        """The library nickname KiCad gives the directory by default"""
+        name = os.path.basename(os.path.normpath(self.directory))
+        return name[:-len('.pretty')] if name.endswith('.pretty') else name
+
+    @property
+    def names(self):
+        return sorted(entry.name[:-len(FOOTPRINT_EXTENSION)] for entry in os.scandir(self.directory)
+                      if entry.name.endswith(FOOTPRINT_EXTENSION) and entry.is_file())
+
+    def filename(self, name):
+        return os.path.join(self.directory, name + FOOTPRINT_EXTENSION)
+
+    def __iter__(self):
+        for name in self.names:
+            yield self[name]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return os.path.isfile(self.filename(name))
+
+    def __getitem__(self, name):
+        if name not in self._footprints:
+            try:
+                self._footprints[name] = Footprint.load(self.filename(name))
+            except FileNotFoundError:
+                raise KeyError(name) from None
+        return self._footprints[name]
+
+    def save(self, name):
+        """Write the (loaded) footprint called name back to its file"""
+        self._footprints[name].save(self.filename(name))
+
+
+class FootprintInfo:
+    """What FootprintIndex records about a footprint file. pad_count is None if the file
+    couldn't be parsed, and bounding_box is None if it has no pads or graphics"""
+
+    __slots__ = ('name', 'size', 'mtime_ns', 'content_hash', 'pad_count', 'layers', 'bounding_box')
+
+    def __init__(self, name, size, mtime_ns, content_hash, pad_count, layers, bounding_box):
+        self.name = name
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.content_hash = content_hash
+        self.pad_count = pad_count
+        self.layers = layers  # sorted list of layer names
+        self.bounding_box = bounding_box  # [min x, min y, max x, max y], or None
+
+    @classmethod
+    def from_file(cls, filename, name, st, previous=None):
+        """Index the footprint file filename, whose os.stat() is st. If previous (the
+        FootprintInfo from an older index) has the same content hash, the file was only
+        touched, and it isn't parsed again"""
+        with open(filename, 'rb') as f:
+            data = f.read()
+        content_hash = hashlib.sha1(data).hexdigest()
+        if previous is not None and previous.content_hash == content_hash:
+            return cls(name, st.st_size, st.st_mtime_ns, content_hash, previous.pad_count, previous.layers,
+                       previous.bounding_box)
+        try:
+            footprint = Footprint.parse(data.decode('utf-8'))
+        except (ValueError, UnicodeDecodeError) as e:
+            print(' --Warning: could not parse footprint {}: {}'.format(filename, e))
+            return cls(name, st.st_size, st.st_mtime_ns, content_hash, None, [], None)
+        bounding_box = footprint.bounding_box()
+        return cls(name, st.st_size, st.st_mtime_ns, content_hash, len(footprint.pads), sorted(footprint.layers),
+                   list(bounding_box) if bounding_box is not None else None)
+
+    def to_list(self):
+        return [self.size, self.mtime_ns, self.content_hash, self.pad_count, self.layers, self.bounding_box]
+
+    def __repr__(self):
+        return 'FootprintInfo({!r}, {} pads)'.format(self.name, self.pad_count)
+
+
+class FootprintIndex:
+    """Index of the footprints in a .pretty directory.
+
+    The index is cached in <directory>.index next to the directory, or if that
+    can't be written (e.g. a read only system library) or beside is False, in a
+    per-user temporary file named after a hash of the directory's path. load()
+    checks the size and modification time of each footprint file against the
+    cached index, and only reads the files which are new or have changed (and only
+    parses the ones whose content hash has changed too).
+    """
+
+    version = 1
+
+    def __init__(self, directory, footprints):
+        self.directory = directory
+        self.footprints = footprints  # dict of name to FootprintInfo, in name order
+        self._by_pad_count = None
+
+    @staticmethod
+    def index_filename(directory):
+        return os.path.normpath(directory) + '.index'
+
+    @staticmethod
+    def cache_filename(directory):
+        """Where the index of directory is cached when index_filename() can't be written"""
+        path_hash = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()
+        return os.path.join(tempfile.gettempdir(), 'kicad_footprint_index_{}.json'.format(path_hash))
+
+    @classmethod
+    def load(cls, directory, beside=True):
+        """Return the index of directory, brought up to date and cached (next to it if
+        beside is set)"""
+        # read the newest of the cached indexes, in case the one next to the directory
+        # is an old one that can't be rewritten any more
+        cached = dict()
+        newest = None
+        for filename in (cls.index_filename(directory), cls.cache_filename(directory)):
+            try:
+                mtime_ns = os.stat(filename).st_mtime_ns
+                if newest is not None and mtime_ns <= newest:
+                    continue
+                with open(filename, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data['version'] == cls.version:
+                    cached = {name: FootprintInfo(name, *info) for name, info in data['footprints']}
+                    newest = mtime_ns
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+        footprints = dict()
+        changed = False
+        entries = sorted((entry for entry in os.scandir(directory)
+                          if entry.name.endswith(FOOTPRINT_EXTENSION) and entry.is_file()),
+                         key=lambda entry: entry.name)
+        for entry in entries:
+            name = entry.name[:-len(FOOTPRINT_EXTENSION)]
+            st = entry.stat()
+            info = cached.get(name)
+            if info is None or info.size != st.st_size or info.mtime_ns != st.st_mtime_ns:
+                info = FootprintInfo.from_file(entry.path, name, st, info)
+                changed = True
+            footprints[name] = info
+
+        index = cls(directory, footprints)
+        if changed or len(footprints) != len(cached):
+            try:
+                index.save(beside)
+            except OSError as e:
+                # the index still works, it just gets rebuilt next time
+                print(' --Warning: could not save the footprint index of {}: {}'.format(directory, e))
+        return index
+
+    def save(self, beside=True):
+        """Write the index next to its directory if beside is set, or else (or if it
+        can't be written there) to cache_filename()"""
+        data = json.dumps({
+            'version': self.version,
+            'footprints': [[name, info.to_list()] for name, info in self.footprints.items()],
+        }, separators=(',', ':')).encode('utf-8')
+        if beside:
+            try:
+                with atomic_write(self.index_filename(self.directory), fsync=False) as f:
+                    f.write(data)
+                return
+            except OSError:
+                pass
+        with atomic_write(self.cache_filename(self.directory), fsync=False) as f:
+            f.write(data)
+
+    def __iter__(self):
+        return iter(self.footprints)
+
+    def __len__(self):
+        return len(self.footprints)
+
+    def __contains__(self, name):
+        return name in self.footprints
+
+    def __getitem__(self, name):
+        return self.footprints[name]
+
+    def get(self, name, default=None):
+        return self.footprints.get(name, default)
+
+    def with_pad_count(self, pad_count):
+        """The names of the footprints with pad_count pads"""
+        if self._by_pad_count is None:
+            self._by_pad_count = dict()
+            for name, info in self.footprints.items():
+                self._by_pad_count.setdefault(info.pad_count, []).append(name)
+        return self._by_pad_count.get(pad_count, [])
+
+
+_lib_table_var_re = re.compile(r'\$\{(\w+)\}')
+
+
+class FootprintLibraries:
+    """The FootprintIndexes of several libraries, looked up by library nickname, so
+    footprints can be found by the "library:footprint" ids used in schematics and
+    netlists. Each library is only indexed when it is first needed, and its index is
+    cached next to it unless index_beside is False (see FootprintIndex)."""
+
+    def __init__(self, directories, index_beside=True):
+        self.directories = directories  # dict of nickname to .pretty directory
+        self.index_beside = index_beside
+        self._indexes = dict()
+
+    @classmethod
+    def from_directories(cls, directories):
+        """Libraries named after their directories, as KiCad names them by default"""
+        return cls({FootprintLibrary(directory).name: directory for directory in directories})
+
+    @classmethod
+    def from_lib_table(cls, filename, variables=None):
+        """The KiCad format libraries in an fp-lib-table file. ${VARIABLES} in their
+        paths are taken from variables, then the environment; KIPRJMOD defaults to the
+        directory of the table"""
+        variables = dict(variables or {})
+        variables.setdefault('KIPRJMOD', os.path.dirname(os.path.abspath(filename)))
+
+        def expand(match):
+            return variables.get(match.group(1), os.environ.get(match.group(1), match.group(0)))
+
+        with open(filename, 'r', encoding='utf-8') as f:
+            _, table, _ = parse_sexpr(f.read())
+        directories = dict()
+        for lib in table.children('lib'):
+            name, lib_type, uri = lib.child('name'), lib.child('type'), lib.child('uri')
+            if name is None or uri is None or (lib_type is not None and lib_type.value() != 'KiCad'):
+                continue
+            directories[name.value()] = _lib_table_var_re.sub(expand, uri.value())
+        return cls(directories)
+
+    @staticmethod
+    def split_id(lib_id):
+        """Split "library:footprint" into (library, footprint)"""
+        library, _, name = lib_id.rpartition(':')
+        return library, name
+
+    def index(self, library):
+        """The FootprintIndex of the library nicknamed library, or None if there is no
+        such library (or its directory is missing or can't be read)"""
+        if library not in self._indexes:
+            index = None
+            if library in self.directories:
+                try:
+                    index = FootprintIndex.load(self.directories[library], self.index_beside)
+                except FileNotFoundError:
+                    print(' --Warning: footprint library {} not found at {}'.format(library,
+                                                                                     self.directories[library]))
+                except OSError as e:
+                    # e.g. not a directory, or not readable
+                    print(' --Warning: could not read footprint library {}: {}'.format(library, e))
+            self._indexes[library] = index
+        return self._indexes[library]
+
+    def get(self, lib_id, default=None):
+        """The FootprintInfo of lib_id, or default"""
+        library, name = self.split_id(lib_id)
+        index = self.index(library)
+        if index is None:
+            return default
+        return index.get(name, default)
+
+    def __contains__(self, lib_id):
+        return self.get(lib_id) is not None
+
+    def __getitem__(self, lib_id):
+        info = self.get(lib_id)
+        if info is None:
+            raise KeyError(lib_id)
+        return info
+
+    def __iter__(self):
+        """The ids of every footprint in every library"""
+        for library in self.directories:
+            index = self.index(library)
+            if index is not None:
+                for name in index:
+                    yield '{}:{}'.format(library, name)
+
+    def with_pad_count(self, pad_count):
+        """The ids of the footprints with pad_count pads, in every library"""
+        lib_ids = []
+        for library in self.directories:
+            index = self.index(library)
+            if index is not None:
+                lib_ids.extend('{}:{}'.format(library, name) for name in index.with_pad_count(pad_count))
+        return lib_ids
@@ -20,7 +20,6 @@ from __future__ import print_function
 import sys
 import xml.sax as sax
 import re
-import pdb
 import string
 
 #-----<Configure>----------------------------------------------------------------
@@ -70,6 +69,9 @@ excluded_footprints = [
 
 #-----</Configure>---------------------------------------------------------------
 
+# Parser backends accepted by netlist(parser=...) and netlist.load()
+PARSERS = ("sax", "etree")
+
 
 class xmlElement():
     """xml element which can represent all nodes of the netlist tree.  It can be
@@ -214,6 +216,16 @@ class xmlElement():
         else:
             return self.children
 
+    def iterDescendants(self, name):
+        """Yield every element below this one named 'name', depth first and in
+        document order (the same order get() searches in)"""
+        for child in self.children:
+            if child.name == name:
+                yield child
+            else:
+                for c in child.iterDescendants(name):
+                    yield c
+
     def get(self, elemName, attribute="", attrmatch=""):
         """Return the text data for either an attribute or an xmlElement
         """
@@ -250,6 +262,82 @@ class xmlElement():
 
 
 
+def _getAttr(element, elemName, attribute):
+    """xmlElement.get for an attribute, returning "" when it is missing
+    rather than raising KeyError"""
+    try:
+        return element.get(elemName, attribute)
+    except KeyError:
+        return ""
+
+
+def _fieldDict(element):
+    """Return a {name: value} dict of the field elements below element.  As
+    with xmlElement.get, the first non-empty value for a name wins.
+    """
+    fields = {}
+    for f in element.iterDescendants('field'):
+        name = f.attributes.get('name')
+        if name is not None and f.chars != "" and name not in fields:
+            fields[name] = f.chars
+    return fields
+
+
+def _fieldNames(element):
+    """Return a tuple of the names of the fields in element's 'fields' child"""
+    fields = element.getChild('fields')
+    if fields:
+        return tuple( f.get('field','name') for f in fields.getChildren() )
+    return ()
+
+
+class _libpartRecord(object):
+    """Values read out of a libpart's xmlElement, computed once on first use so
+    the accessors don't walk the tree on every call.
+    """
+    __slots__ = ('libName', 'partName', 'description', 'fields', 'fieldNames',
+                 'aliases', 'footprintFilters')
+
+    def __init__(self, element):
+        self.libName = _getAttr(element, "libpart", "lib")
+        self.partName = _getAttr(element, "libpart", "part")
+        self.description = element.get("description")
+        self.fields = _fieldDict(element)
+        self.fieldNames = _fieldNames(element)
+
+        aliases = element.getChild("aliases")
+        if aliases:
+            self.aliases = tuple( child.get("alias") for child in aliases.getChildren() )
+        else:
+            self.aliases = None
+
+        footprints = element.getChild("footprints")
+        if footprints:
+            self.footprintFilters = tuple( child.get("fp") for child in footprints.getChildren() )
+        else:
+            self.footprintFilters = ()
+
+
+class _compRecord(object):
+    """Values read out of a comp's xmlElement, computed once on first use so
+    the accessors don't walk the tree on every call.  Dropped by comp.setValue.
+    """
+    __slots__ = ('ref', 'value', 'footprint', 'datasheet', 'tstamp', 'libName',
+                 'partName', 'description', 'fields', 'fieldNames')
+
+    def __init__(self, element):
+        self.ref = _getAttr(element, "comp", "ref")
+        self.value = element.get("value")
+        self.footprint = element.get("footprint")
+        self.datasheet = element.get("datasheet")
+        self.tstamp = element.get("tstamp")
+        self.libName = _getAttr(element, "libsource", "lib")
+        self.partName = _getAttr(element, "libsource", "part")
+        self.description = _getAttr(element, "libsource", "description")
+        self.fields = _fieldDict(element)
+        self.fieldNames = _fieldNames(element)
+
+
 class libpart():
     """Class for a library part, aka 'libpart' in the xml netlist file.
     (Components in eeschema are instantiated from library parts.)
@@ -259,32 +347,33 @@ class libpart():
     def __init__(self, xml_element):
         #
         self.element = xml_element
+        self._record = None
 
     #def __str__(self):
         # simply print the xmlElement associated with this part
         #return str(self.element)
 
+    def _getRecord(self):
+        if self._record is None:
+            self._record = _libpartRecord(self.element)
+        return self._record
+
     def getLibName(self):
-        return self.element.get("libpart", "lib")
+        return self._getRecord().libName
 
     def getPartName(self):
-        return self.element.get("libpart", "part")
+        return self._getRecord().partName
 
     def getDescription(self):
-        return self.element.get("description")
+        return self._getRecord().description
 
     def getField(self, name):
-        return self.element.get("field", "name", name)
+        return self._getRecord().fields.get(name, "")
 
     def getFieldNames(self):
         """Return a list of field names in play for this libpart.
         """
-        fieldNames = []
-        fields = self.element.getChild('fields')
-        if fields:
-            for f in fields.getChildren():
-                fieldNames.append( f.get('field','name') )
-        return fieldNames
+        return list(self._getRecord().fieldNames)
 
     def getDatasheet(self):
         return self.getField("Datasheet")
@@ -294,15 +383,15 @@ class libpart():
 
     def getAliases(self):
         """Return a list of aliases or None"""
-        aliases = self.element.getChild("aliases")
-        if aliases:
-            ret = []
-            children = aliases.getChildren()
-            # grab the text out of each child:
-            for child in children:
-                ret.append( child.get("alias") )
-            return ret
-        return None
+        aliases = self._getRecord().aliases
+        if aliases is None:
+            return None
+        return list(aliases)
+
+    def getFootprintFilters(self):
+        """Return the list of footprint filters (the symbol's $FPLIST), which may
+        be empty"""
+        return list(self._getRecord().footprintFilters)
 
 
 class comp():
@@ -314,6 +403,7 @@ class comp():
     def __init__(self, xml_element):
         self.element = xml_element
         self.libpart = None
+        self._record = None
 
         # Set to true when this component is included in a component group
         self.grouped = False
@@ -340,6 +430,11 @@ class comp():
                     result = True
         return result
 
+    def _getRecord(self):
+        if self._record is None:
+            self._record = _compRecord(self.element)
+        return self._record
+
     def setLibPart(self, part):
         self.libpart = part
 
@@ -347,19 +442,20 @@ class comp():
         return self.libpart
 
     def getPartName(self):
-        return self.element.get("libsource", "part")
+        return self._getRecord().partName
 
     def getLibName(self):
-        return self.element.get("libsource", "lib")
+        return self._getRecord().libName
 
     def setValue(self, value):
         """Set the value of this component"""
         v = self.element.getChild("value")
         if v:
             v.setChars(value)
+            self._record = None
 
     def getValue(self):
-        return self.element.get("value")
+        return self._getRecord().value
 
     def getField(self, name, libraryToo=True):
         """Return the value of a field named name. The component is first
@@ -373,7 +469,7 @@ class comp():
                         in component itself
         """
 
-        field = self.element.get("field", "name", name)
+        field = self._getRecord().fields.get(name, "")
         if field == "" and libraryToo and self.libpart:
             field = self.libpart.getField(name)
         return field
@@ -384,33 +480,28 @@ class comp():
         The netlist format only includes fields with non-empty values.  So if a field
         is empty, it will not be present in the returned list.
         """
-        fieldNames = []
-        fields = self.element.getChild('fields')
-        if fields:
-            for f in fields.getChildren():
-                fieldNames.append( f.get('field','name') )
-        return fieldNames
+        return list(self._getRecord().fieldNames)
 
     def getRef(self):
-        return self.element.get("comp", "ref")
+        return self._getRecord().ref
 
     def getFootprint(self, libraryToo=True):
-        ret = self.element.get("footprint")
+        ret = self._getRecord().footprint
         if ret == "" and libraryToo and self.libpart:
             ret = self.libpart.getFootprint()
         return ret
 
     def getDatasheet(self, libraryToo=True):
-        ret = self.element.get("datasheet")
+        ret = self._getRecord().datasheet
         if ret == "" and libraryToo and self.libpart:
             ret = self.libpart.getDatasheet()
         return ret
 
     def getTimestamp(self):
-        return self.element.get("tstamp")
+        return self._getRecord().tstamp
 
     def getDescription(self):
-        return self.element.get("libsource", "description")
+        return self._getRecord().description
 
 
 class netlist():
@@ -419,13 +510,22 @@ class netlist():
     scripts
 
     """
-    def __init__(self, fname=""):
+    def __init__(self, fname="", sections=None, parser="sax"):
         """Initialiser for the genericNetlist class
 
         Keywords:
         fname -- The name of the generic netlist file to open (Optional)
+        sections -- The top level sections of the netlist to load, e.g.
+                    {"design", "components", "libparts"}.  Elements in any
+                    other section (typically the large "nets" section) are
+                    skipped while parsing and never built.  None loads all.
+        parser -- The parser backend used by load(), either "sax" or "etree".
+                  "etree" uses ElementTree.iterparse, or lxml when it is
+                  installed, and builds the same tree as "sax".
 
         """
+        self.sections = sections
+        self.parser = parser
         self.design = None
         self.components = []
         self.libparts = []
@@ -485,21 +585,30 @@ class netlist():
         # When the document is complete, the library parts must be linked to
         # the components as they are seperate in the tree so as not to
         # duplicate library part information for every component
+        index = self.buildLibPartIndex()
         for c in self.components:
-            for p in self.libparts:
-                if p.getLibName() == c.getLibName():
-                    if p.getPartName() == c.getPartName():
-                        c.setLibPart(p)
-                        break
-                    else:
-                        aliases = p.getAliases()
-                        if aliases and self.aliasMatch( c.getPartName(), aliases ):
-                            c.setLibPart(p)
-                            break;
-
-            if not c.getLibPart():
+            p = index.get( (c.getLibName(), c.getPartName()) )
+            if p:
+                c.setLibPart(p)
+            else:
                 print( 'missing libpart for ref:', c.getRef(), c.getPartName(), c.getLibName() )
 
+    def buildLibPartIndex(self):
+        """Return a dict mapping (lib, part) and (lib, alias) to libparts.
+
+        The first libpart in the netlist wins on duplicates, which gives the
+        same result as scanning self.libparts for each component.
+        """
+        index = {}
+        for p in self.libparts:
+            lib = p.getLibName()
+            index.setdefault( (lib, p.getPartName()), p )
+            aliases = p.getAliases()
+            if aliases:
+                for alias in aliases:
+                    index.setdefault( (lib, alias), p )
+        return index
+
 
     def aliasMatch(self, partName, aliasList):
         for alias in aliasList:
@@ -632,39 +741,30 @@ class netlist():
         return ret
 
 
-    def groupComponents(self, components = None):
+    def groupComponents(self, components = None, key = None):
         """Return a list of component lists. Components are grouped together
         when the value, library and part identifiers match.
 
         Keywords:
         components -- is a list of components, typically an interesting subset
         of all components, or None.  If None, then all components are looked at.
+        key -- optional function returning a hashable grouping key for a
+        component.  Components with equal keys are grouped in a single pass,
+        and a key of None puts the component in a group of its own.  If not
+        given, components are compared pairwise with comp.__eq__ (or whatever
+        it has been overridden with).
         """
         if not components:
             components = self.components
 
-        groups = []
-
         # Make sure to start off will all components ungrouped to begin with
         for c in components:
             c.grouped = False
 
-        # Group components based on the value, library and part identifiers
-        for c in components:
-            if c.grouped == False:
-                c.grouped = True
-                newgroup = []
-                newgroup.append(c)
-
-                # Check every other ungrouped component against this component
-                # and add to the group as necessary
-                for ci in components:
-                    if ci.grouped == False and ci == c:
-                        newgroup.append(ci)
-                        ci.grouped = True
-
-                # Add the new component group to the groups list
-                groups.append(newgroup)
+        if key:
+            groups = self._groupComponentsByKey(components, key)
+        else:
+            groups = self._groupComponentsByEquality(components)
 
         # The key to sort the components in the BOM
         # This sorts using a natural sorting order (e.g. 100 after 99), and if it wasn't used
@@ -682,6 +782,42 @@ class netlist():
 
         return groups
 
+    def _groupComponentsByKey(self, components, key):
+        """Bucket components by key(component), preserving first-seen order"""
+        groups = []
+        buckets = {}
+        for c in components:
+            c.grouped = True
+            k = key(c)
+            if k is None:
+                groups.append([c])
+            elif k in buckets:
+                buckets[k].append(c)
+            else:
+                buckets[k] = [c]
+                groups.append(buckets[k])
+        return groups
+
+    def _groupComponentsByEquality(self, components):
+        """Group components by comparing each pair with comp.__eq__"""
+        groups = []
+        for c in components:
+            if c.grouped == False:
+                c.grouped = True
+                newgroup = []
+                newgroup.append(c)
+
+                # Check every other ungrouped component against this component
+                # and add to the group as necessary
+                for ci in components:
+                    if ci.grouped == False and ci == c:
+                        newgroup.append(ci)
+                        ci.grouped = True
+
+                # Add the new component group to the groups list
+                groups.append(newgroup)
+        return groups
+
     def getGroupField(self, group, field):
         """Return the whatever is known about the given field by consulting each
         component in the group.  If any of them know something about the property/field,
@@ -733,17 +869,27 @@ class netlist():
         """Return the whole netlist formatted in HTML"""
         return self.tree.formatHTML()
 
-    def load(self, fname):
+    def load(self, fname, parser=None):
         """Load a kicad generic netlist
 
         Keywords:
         fname -- The name of the generic netlist file to open
+        parser -- "sax" or "etree", defaults to the parser given to __init__
 
         """
+        if parser is None:
+            parser = self.parser
+        if parser not in PARSERS:
+            raise ValueError("unknown netlist parser '%s', expected one of %s"
+                             % (parser, ", ".join(sorted(PARSERS))))
+
         try:
-            self._reader = sax.make_parser()
-            self._reader.setContentHandler(_gNetReader(self))
-            self._reader.parse(fname)
+            if parser == "etree":
+                _gNetIterReader(self).parse(fname)
+            else:
+                self._reader = sax.make_parser()
+                self._reader.setContentHandler(_gNetReader(self))
+                self._reader.parse(fname)
         except IOError as e:
             print( __file__, ":", e, file=sys.stderr )
             sys.exit(-1)
@@ -752,28 +898,101 @@ class netlist():
 
 class _gNetReader(sax.handler.ContentHandler):
     """SAX kicad generic netlist content handler - passes most of the work back
-    to the 'netlist' class which builds a complete tree in RAM for the design
+    to the 'netlist' class which builds a complete tree in RAM for the design.
+    Top level sections not in the parent's 'sections' are skipped.
 
     """
     def __init__(self, aParent):
         self.parent = aParent
+        self._depth = 0
+        # depth of the section currently being skipped, 0 when not skipping
+        self._skipDepth = 0
 
     def startElement(self, name, attrs):
         """Start of a new XML element event"""
+        self._depth += 1
+        if self._skipDepth:
+            return
+        if self._depth == 2 and self.parent.sections is not None \
+                and name not in self.parent.sections:
+            self._skipDepth = self._depth
+            return
+
         element = self.parent.addElement(name)
 
         for name in attrs.getNames():
             element.addAttribute(name, attrs.getValue(name))
 
     def endElement(self, name):
-        self.parent.endElement()
+        if self._skipDepth:
+            if self._depth == self._skipDepth:
+                self._skipDepth = 0
+        else:
+            self.parent.endElement()
+        self._depth -= 1
 
     def characters(self, content):
         # Ignore erroneous white space - ignoreableWhitespace does not get rid
         # of the need for this!
-        if not content.isspace():
+        if not self._skipDepth and not content.isspace():
             self.parent.addChars(content)
 
     def endDocument(self):
         """End of the XML document event"""
         self.parent.endDocument()
+
+
+class _gNetIterReader():
+    """iterparse kicad generic netlist reader - the equivalent of _gNetReader
+    for the "etree" parser.  Feeds the same events to the 'netlist' class, but
+    lets ElementTree (or lxml, if available) do the tokenising in C.
+
+    """
+    def __init__(self, aParent):
+        self.parent = aParent
+
+    def parse(self, fname):
+        try:
+            from lxml import etree
+        except ImportError:
+            import xml.etree.ElementTree as etree
+
+        depth = 0
+        # depth of the section currently being skipped, 0 when not skipping
+        skipDepth = 0
+        sections = self.parent.sections
+
+        for event, elem in etree.iterparse(fname, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if skipDepth:
+                    continue
+                if depth == 2 and sections is not None and elem.tag not in sections:
+                    skipDepth = depth
+                    continue
+
+                element = self.parent.addElement(elem.tag)
+                for name, value in elem.attrib.items():
+                    element.addAttribute(name, value)
+            else:
+                if skipDepth:
+                    if depth == skipDepth:
+                        skipDepth = 0
+                else:
+                    # Text is only complete at the end tag.  As with the SAX
+                    # reader, ignore runs of white space between elements
+                    if elem.text and not elem.text.isspace():
+                        self.parent.addChars(elem.text)
+                    for child in elem:
+                        if child.tail and not child.tail.isspace():
+                            self.parent.addChars(child.tail)
+                    self.parent.endElement()
+
+                # the children's tails have been read now, so they can be freed.
+                # elem itself is kept until its parent ends, as its own tail is
+                # only read then
+                del elem[:]
+                depth -= 1
+
+        self.parent.endDocument()
+
@@ -0,0 +1,743 @@
+"""
+    @package
+    Reader/writer for KiCad legacy symbol libraries (EESchema-LIBRARY Version 2.4
+    .lib files) and their documentation files (EESchema-DOCLIB Version 2.0 .dcm
+    files).
+
+    Files are parsed in a single pass into SymbolLibrary/Symbol/Field and
+    DocLibrary/DocEntry objects. Every line is kept verbatim unless it is edited,
+    so dumps() gives back exactly the text that was parsed (line endings and
+    all), and editing one field only changes that field's line.
+
+    For large libraries where only a few symbols need touching, SymbolIndex
+    finds symbols by byte offset instead, and patches just the changed F lines.
+
+    Example:
+        lib = SymbolLibrary.load('matt_R_0603.lib')
+        for symbol in lib:
+            print(symbol.name, symbol.get_field('LCSC Part #'), symbol.fplist)
+        lib['10k'].set_field('Price', '0.0012')
+        lib.save('matt_R_0603.lib')
+"""
+
+import contextlib
+import datetime
+import glob
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import tempfile
+
+# Names of the mandatory fields F0 to F3, which have no name in the file
+MANDATORY_FIELDS = ('Reference', 'Value', 'Footprint', 'Datasheet')
+
+_token_re = re.compile(r'"(?:[^"\\]|\\.)*"|\S+')
+
+
+def split_tokens(line):
+    """Split a line into whitespace separated tokens, keeping quoted strings
+    (which may contain spaces and escaped quotes) as single tokens"""
+    return _token_re.findall(line)
+
+
+def unquote(token):
+    if len(token) >= 2 and token[0] == '"' and token[-1] == '"':
+        return re.sub(r'\\(.)', r'\1', token[1:-1])
+    return token
+
+
+def quote(text):
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+@contextlib.contextmanager
+def atomic_write(filename, mode='wb', fsync=True, **kwargs):
+    """Context manager giving a temporary file, in the same directory as filename,
+    which replaces filename (keeping its permissions) when the block finishes. If the
+    block raises, the temporary file is deleted and filename is left as it was"""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(prefix=os.path.basename(filename) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if os.path.exists(filename):
+            shutil.copymode(filename, tmp_filename)
+        else:
+            # mkstemp() makes the file readable by its owner only
+            os.chmod(tmp_filename, 0o666 & ~_umask)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        try:
+            os.remove(tmp_filename)
+        except OSError:
+            pass
+        raise
+
+
+BACKUP_MODES = ('hardlink', 'copy', 'diff', 'none')
+
+
+def backup_file(filename, mode='hardlink', keep=None, mm=None, edits=None):
+    """Back up filename before it is replaced, as <filename>.bak_<timestamp>.
+
+    mode is one of BACKUP_MODES:
+        hardlink: a hard link to the current file, which costs no space or copying
+            as long as the file is then replaced (e.g. by atomic_write()) rather
+            than written in place. Falls back to a copy if hard links aren't supported.
+        copy: a full copy of the file.
+        diff: a unified diff from the current file to the new one, in
+            <filename>.bak_<timestamp>.diff, which needs mm (an mmap of the current
+            file) and edits (the (start, end, bytes) replacements to be made to it).
+            `patch -R` it against the new file to get the old one back.
+        none: no backup.
+
+    If keep is set, only the newest keep backups of filename are kept.
+    """
+    if mode not in BACKUP_MODES:
+        raise ValueError('unknown backup mode {}, expected one of {}'.format(mode, ', '.join(BACKUP_MODES)))
+    if mode == 'none':
+        return None
+
+    stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    backup = '{}.bak_{}'.format(filename, stamp)
+    same_second = glob.glob(glob.escape(backup) + '*')
+    if same_second:
+        backup = '{}.bak_{}_{}'.format(filename, stamp, max(_backup_sort_key(b)[1] for b in same_second) + 1)
+    if mode == 'diff':
+        backup += '.diff'
+
+    if mode == 'diff':
+        name = os.path.basename(filename)
+        with open(backup, 'w', encoding='utf-8', newline='') as f:
+            f.writelines(_unified_diff(mm, edits, 'a/' + name, 'b/' + name))
+    elif mode == 'hardlink':
+        try:
+            os.link(filename, backup)
+        except OSError:
+            shutil.copy2(filename, backup)
+    else:
+        shutil.copy2(filename, backup)
+
+    if keep is not None:
+        prune_backups(filename, keep)
+    return backup
+
+
+def prune_backups(filename, keep):
+    """Delete all but the newest keep backups of filename"""
+    backups = sorted(glob.glob(glob.escape(filename) + '.bak_*'), key=_backup_sort_key)
+    for backup in backups[:max(0, len(backups) - keep)]:
+        os.remove(backup)
+
+
+def _backup_sort_key(backup):
+    # <filename>.bak_<date>_<time>[_<n>][.diff]
+    stamp = backup.rsplit('.bak_', 1)[1]
+    if stamp.endswith('.diff'):
+        stamp = stamp[:-len('.diff')]
+    parts = stamp.split('_')
+    return parts[:2], int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 0
+
+
+def _unified_diff(mm, edits, fromfile, tofile):
+    """Yield the lines of a unified diff (without context lines) for applying edits,
+    a sorted list of (start, end, bytes) replacements of whole lines, to mm"""
+    yield '--- {}\n'.format(fromfile)
+    yield '+++ {}\n'.format(tofile)
+    line = 1
+    pos = 0
+    offset = 0
+    for start, end, data in edits:
+        line += mm[pos:start].count(b'\n')
+        old = mm[start:end].decode('utf-8').splitlines(True)
+        new = data.decode('utf-8').splitlines(True)
+        # an empty range is given as the line before it
+        yield '@@ -{},{} +{},{} @@\n'.format(line if old else line - 1, len(old),
+                                            line + offset if new else line + offset - 1, len(new))
+        for text in old:
+            yield '-' + text
+        for text in new:
+            yield '+' + text
+        offset += len(new) - len(old)
+        line += len(old)
+        pos = end
+
+
+def _line_ending(line):
+    if line.endswith('\r\n'):
+        return '\r\n'
+    if line.endswith('\n'):
+        return '\n'
+    return ''
+
+
+class Field:
+    """An F line of a symbol: F<number> "<value>" <posx> <posy> <size> <orientation>
+    <visibility> <hjustify> <vjustify/style> ["<name>"]"""
+
+    __slots__ = ('number', 'value', 'attributes', 'name', '_line', '_eol')
+
+    def __init__(self, number, value, attributes, name, line=None, eol='\n'):
+        self.number = number
+        self.value = value
+        self.attributes = attributes  # the position, size, etc. tokens, as strings
+        self.name = name
+        self._line = line
+        self._eol = eol
+
+    @classmethod
+    def parse(cls, line):
+        tokens = split_tokens(line)
+        number = int(tokens[0][1:])
+        value = unquote(tokens[1])
+        if number < len(MANDATORY_FIELDS):
+            name = MANDATORY_FIELDS[number]
+            attributes = tokens[2:]
+        else:
+            name = unquote(tokens[-1])
+            attributes = tokens[2:-1]
+        return cls(number, value, attributes, name, line, _line_ending(line))
+
+    def set_value(self, value):
+        if value != self.value:
+            self.value = value
+            self._line = None
+
+    def dumps(self):
+        if self._line is not None:
+            return self._line
+        tokens = ['F{}'.format(self.number), quote(self.value)] + list(self.attributes)
+        if self.number >= len(MANDATORY_FIELDS):
+            tokens.append(quote(self.name))
+        return ' '.join(tokens) + self._eol
+
+    def __repr__(self):
+        return 'Field({}, {!r}, {!r})'.format(self.number, self.name, self.value)
+
+
+class Symbol:
+    """A DEF ... ENDDEF symbol.
+
+    preamble holds the (comment) lines between the previous symbol and this
+    one's DEF line, and body holds the lines after the F fields (ALIAS, $FPLIST,
+    DRAW, ...) up to and including ENDDEF.
+    """
+
+    __slots__ = ('name', 'reference', 'preamble', 'def_line', 'fields', 'body', '_eol')
+
+    def __init__(self, def_line, preamble=None):
+        tokens = def_line.split()
+        self.name = unquote(tokens[1])
+        self.reference = tokens[2] if len(tokens) > 2 else ''
+        self.preamble = preamble or []
+        self.def_line = def_line
+        self.fields = []
+        self.body = []
+        self._eol = _line_ending(def_line) or '\n'
+
+    def field(self, name):
+        """Return the Field called name, or None"""
+        for field in self.fields:
+            if field.name == name:
+                return field
+        return None
+
+    def get_field(self, name, default=None):
+        """Return the value of the field called name, or default if there isn't one"""
+        field = self.field(name)
+        if field is None:
+            return default
+        return field.value
+
+    def set_field(self, name, value):
+        """Set the value of the field called name, adding a (hidden) field if there isn't one"""
+        field = self.field(name)
+        if field is None:
+            number = max([f.number for f in self.fields] + [len(MANDATORY_FIELDS) - 1]) + 1
+            field = Field(number, value, ['0', '0', '50', 'H', 'I', 'C', 'CNN'], name, eol=self._eol)
+            self.fields.append(field)
+        else:
+            field.set_value(value)
+        return field
+
+    @property
+    def aliases(self):
+        aliases = []
+        for line in self.body:
+            if line.startswith('ALIAS'):
+                aliases.extend(unquote(token) for token in split_tokens(line)[1:])
+        return aliases
+
+    @property
+    def fplist(self):
+        """The footprint filters in the $FPLIST section"""
+        fplist = []
+        in_fplist = False
+        for line in self.body:
+            if line.startswith('$FPLIST'):
+                in_fplist = True
+            elif line.startswith('$ENDFPLIST'):
+                break
+            elif in_fplist:
+                fplist.extend(line.split())
+        return fplist
+
+    def dumps(self):
+        return ''.join(self.preamble) + self.def_line + ''.join(f.dumps() for f in self.fields) + ''.join(self.body)
+
+    def content_hash(self):
+        """sha1 of the DEF ... ENDDEF lines, ignoring trailing whitespace and line endings"""
+        lines = [self.def_line] + [f.dumps() for f in self.fields] + self.body
+        return hashlib.sha1(''.join(x.rstrip() + '\n' for x in lines).encode('utf-8')).hexdigest()
+
+    def __repr__(self):
+        return 'Symbol({!r})'.format(self.name)
+
+
+class SymbolLibrary:
+    """An EESchema-LIBRARY file: header lines, symbols, and trailer lines"""
+
+    __slots__ = ('header', 'symbols', 'trailer', '_by_name')
+
+    def __init__(self, header=None, symbols=None, trailer=None):
+        self.header = header or []
+        self.symbols = symbols or []
+        self.trailer = trailer or []
+        self._by_name = None
+
+    @classmethod
+    def parse(cls, text):
+        lines = text.splitlines(True)
+        if not lines or not lines[0].startswith('EESchema-LIBRARY'):
+            raise ValueError('not an EESchema-LIBRARY file')
+
+        header = [lines[0]]
+        i = 1
+        while i < len(lines) and lines[i].startswith('#encoding'):
+            header.append(lines[i])
+            i += 1
+
+        symbols, trailer = _parse_symbols(lines[i:])
+        return cls(header, symbols, trailer)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r', encoding='utf-8', newline='') as f:
+            return cls.parse(f.read())
+
+    def dumps(self):
+        return ''.join(self.header) + ''.join(s.dumps() for s in self.symbols) + ''.join(self.trailer)
+
+    def save(self, filename):
+        """Write the library to filename, one symbol at a time, replacing it atomically"""
+        with atomic_write(filename, 'w', encoding='utf-8', newline='') as f:
+            f.writelines(self.header)
+            for symbol in self.symbols:
+                f.write(symbol.dumps())
+            f.writelines(self.trailer)
+
+    def __iter__(self):
+        return iter(self.symbols)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, name):
+        return name in self._index()
+
+    def __getitem__(self, name):
+        return self._index()[name]
+
+    def _index(self):
+        if self._by_name is None or len(self._by_name) != len(self.symbols):
+            self._by_name = {s.name: s for s in self.symbols}
+        return self._by_name
+
+
+def _parse_symbols(lines):
+    """Parse the DEF ... ENDDEF symbols in lines. Returns the list of Symbols, and the
+    lines after the last symbol"""
+    symbols = []
+    pending = []
+    symbol = None
+    in_fields = False
+    for line in lines:
+        if symbol is None:
+            if line.startswith('DEF '):
+                symbol = Symbol(line, pending)
+                pending = []
+                in_fields = True
+            else:
+                pending.append(line)
+        elif in_fields and line.startswith('F') and line[1:2].isdigit():
+            symbol.fields.append(Field.parse(line))
+        else:
+            in_fields = False
+            symbol.body.append(line)
+            if line.startswith('ENDDEF'):
+                symbols.append(symbol)
+                symbol = None
+    if symbol is not None:
+        raise ValueError('symbol {} has no ENDDEF'.format(symbol.name))
+    return symbols, pending
+
+
+# A DEF line, its F lines, and everything else up to and including the ENDDEF line
+_symbol_re = re.compile(rb'''
+    ^(?P<def>DEF[ ]+(?P<name>\S+)[^\n]*(?:\n|$))
+    (?P<fields>(?:F\d[^\n]*(?:\n|$))*)
+    (?:(?!ENDDEF|DEF[ ])[^\n]*\n)*
+    (?P<end>ENDDEF[^\n]*(?:\n|$))?''', re.MULTILINE | re.VERBOSE)
+# An F line: number, value, and (for user fields) name
+_field_re = re.compile(rb'F(\d+)[ ]+"((?:[^"\\\n]|\\.)*)"(?:[^"\n]*"((?:[^"\\\n]|\\.)*)")?[^\n]*(?:\n|$)')
+_unescape_re = re.compile(rb'\\(.)')
+_trailing_space_re = re.compile(rb'[ \t\r\f\v]+(?=\n|$)')
+
+
+def _unescape(quoted_bytes):
+    if b'\\' in quoted_bytes:
+        quoted_bytes = _unescape_re.sub(rb'\1', quoted_bytes)
+    return quoted_bytes.decode('utf-8')
+
+
+class SymbolSpan:
+    """Where a symbol is in a .lib file: the byte offsets of its DEF line and the end
+    of its ENDDEF line, and [start, end, name, value] of each of its F lines"""
+
+    __slots__ = ('start', 'end', 'content_hash', 'fields')
+
+    def __init__(self, start, end=None, content_hash=None, fields=None):
+        self.start = start
+        self.end = end
+        self.content_hash = content_hash
+        self.fields = fields or []
+
+    def get_field(self, name, default=None):
+        for _, _, field_name, value in self.fields:
+            if field_name == name:
+                return value
+        return default
+
+    def shift(self, delta):
+        self.start += delta
+        self.end += delta
+        for field in self.fields:
+            field[0] += delta
+            field[1] += delta
+
+
+class SymbolIndex:
+    """Byte offset index of the symbols in a .lib file.
+
+    The index is built in one scan over an mmap of the library, and cached in
+    <library>.index next to it. load() only rebuilds it when the library's size or
+    modification time no longer match the cached index.
+
+    read_symbols() parses just the named symbols, straight from their byte ranges.
+    diff() and patch() then write the edited symbols back by replacing only the F
+    lines which changed (or inserting the new ones), copying every other byte range
+    of the library across untouched, and shift the index to match rather than
+    scanning the library again.
+    """
+
+    version = 1
+
+    def __init__(self, filename, size, mtime_ns, symbols):
+        self.filename = filename
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.symbols = symbols  # dict of name to SymbolSpan, in file order
+
+    @staticmethod
+    def index_filename(filename):
+        return filename + '.index'
+
+    @classmethod
+    def load(cls, filename):
+        """Return the cached index of filename if it is up to date, otherwise build (and
+        cache) a new one"""
+        st = os.stat(filename)
+        try:
+            with open(cls.index_filename(filename), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data['version'] == cls.version and data['size'] == st.st_size \
+                    and data['mtime_ns'] == st.st_mtime_ns:
+                symbols = {name: SymbolSpan(*span) for name, span in data['symbols']}
+                return cls(filename, st.st_size, st.st_mtime_ns, symbols)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        index = cls.build(filename)
+        index.save()
+        return index
+
+    @classmethod
+    def build(cls, filename):
+        """Scan filename for symbols and F lines"""
+        st = os.stat(filename)
+        symbols = dict()
+        with open(filename, 'rb') as f:
+            if st.st_size == 0:
+                raise ValueError('not an EESchema-LIBRARY file')
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:len(b'EESchema-LIBRARY')] != b'EESchema-LIBRARY':
+                    raise ValueError('not an EESchema-LIBRARY file')
+                for m in _symbol_re.finditer(mm):
+                    if m.group('end') is None:
+                        raise ValueError('symbol {} has no ENDDEF'.format(m.group('name').decode('utf-8')))
+                    start = m.start()
+                    fields = []
+                    for fm in _field_re.finditer(mm, m.end('def'), m.end('fields')):
+                        number, value, name = fm.groups()
+                        value = _unescape(value)
+                        if int(number) < len(MANDATORY_FIELDS):
+                            name = MANDATORY_FIELDS[int(number)]
+                        else:
+                            name = _unescape(name or b'')
+                        fields.append([fm.start(), fm.end(), name, value])
+                    block = mm[start:m.end()]
+                    if b' \n' in block or b'\t\n' in block or b'\r' in block or not block.endswith(b'\n'):
+                        block = _trailing_space_re.sub(b'', block)
+                    if not block.endswith(b'\n'):
+                        block += b'\n'
+                    name = unquote(m.group('name').decode('utf-8'))
+                    symbols.pop(name, None)
+                    symbols[name] = SymbolSpan(start, m.end(), hashlib.sha1(block).hexdigest(), fields)
+        return cls(filename, st.st_size, st.st_mtime_ns, symbols)
+
+    def save(self):
+        index_filename = self.index_filename(self.filename)
+        data = {
+            'version': self.version,
+            'size': self.size,
+            'mtime_ns': self.mtime_ns,
+            'symbols': [[name, [s.start, s.end, s.content_hash, s.fields]] for name, s in self.symbols.items()],
+        }
+        # json.dumps() uses the C encoder, json.dump() doesn't
+        with atomic_write(index_filename, fsync=False) as f:
+            f.write(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+    def __iter__(self):
+        return iter(self.symbols)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, name):
+        return name in self.symbols
+
+    def __getitem__(self, name):
+        return self.symbols[name]
+
+    def _check_current(self):
+        st = os.stat(self.filename)
+        if st.st_size != self.size or st.st_mtime_ns != self.mtime_ns:
+            raise ValueError('{} has changed since it was indexed'.format(self.filename))
+
+    def read_symbols(self, names):
+        """Parse the named symbols from the library, without reading the rest of it.
+        Returns a list of Symbols, in file order"""
+        self._check_current()
+        spans = sorted((self.symbols[name] for name in names), key=lambda s: s.start)
+        if not spans:
+            return []
+        with open(self.filename, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return [_parse_symbols(mm[s.start:s.end].decode('utf-8').splitlines(True))[0][0] for s in spans]
+
+    def read_symbol(self, name):
+        return self.read_symbols([name])[0]
+
+    def diff(self, symbols):
+        """Return the edits needed to write symbols (as returned by read_symbols() and
+        then changed) back to the library, as a sorted list of (start, end, bytes) to
+        replace. Only the F lines of the symbols can have changed."""
+        edits = []
+        for symbol in symbols:
+            span = self.symbols[symbol.name]
+            for i, field in enumerate(symbol.fields):
+                if i < len(span.fields):
+                    if field._line is None:
+                        start, end = span.fields[i][:2]
+                        edits.append((start, end, field.dumps().encode('utf-8')))
+                else:
+                    # new fields go after the last existing one
+                    end = span.fields[-1][1]
+                    edits.append((end, end, field.dumps().encode('utf-8')))
+        edits.sort(key=lambda edit: edit[0])
+        return edits
+
+    def patch(self, symbols, edits=None, backup='hardlink', keep_backups=None):
+        """Write the changes to symbols back to the library, in a single streamed pass
+        which copies the untouched byte ranges across into a temporary file, which
+        then atomically replaces the library. If anything changed the old library is
+        backed up first (see backup_file()). Returns whether anything changed"""
+        if edits is None:
+            edits = self.diff(symbols)
+        if not edits:
+            return False
+        self._check_current()
+
+        with atomic_write(self.filename) as out:
+            with open(self.filename, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    backup_file(self.filename, backup, keep_backups, mm=mm, edits=edits)
+                    pos = 0
+                    for start, end, data in edits:
+                        out.write(mm[pos:start])
+                        out.write(data)
+                        pos = end
+                    out.write(mm[pos:])
+
+        self._shift(symbols, edits)
+        st = os.stat(self.filename)
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.save()
+        return True
+
+    def _shift(self, symbols, edits):
+        """Move the spans to where they are after edits were applied"""
+        patched = {symbol.name: symbol for symbol in symbols}
+        i = 0
+        delta = 0
+        for name, span in self.symbols.items():
+            # the edits are all within the F lines of patched symbols, so every edit
+            # before this symbol starts has been applied to delta already
+            while i < len(edits) and edits[i][0] < span.start:
+                delta += len(edits[i][2]) - (edits[i][1] - edits[i][0])
+                i += 1
+            if name not in patched:
+                span.shift(delta)
+                continue
+            symbol = patched[name]
+            span_delta = 0
+            while i < len(edits) and edits[i][0] < span.end:
+                span_delta += len(edits[i][2]) - (edits[i][1] - edits[i][0])
+                i += 1
+            span.start += delta
+            pos = span.start + len(symbol.def_line.encode('utf-8'))
+            span.fields = []
+            for field in symbol.fields:
+                end = pos + len(field.dumps().encode('utf-8'))
+                span.fields.append([pos, end, field.name, field.value])
+                pos = end
+            delta += span_delta
+            span.end += delta
+            span.content_hash = symbol.content_hash()
+
+
+class DocEntry:
+    """A $CMP ... $ENDCMP entry of a .dcm file, with D (description), K (keywords)
+    and F (datasheet) lines"""
+
+    __slots__ = ('name', 'preamble', 'lines')
+
+    def __init__(self, name, preamble, lines):
+        self.name = name
+        self.preamble = preamble
+        self.lines = lines  # from $CMP to $ENDCMP inclusive
+
+    def _get(self, key):
+        for line in self.lines:
+            if line.startswith(key + ' '):
+                return line[2:].rstrip('\r\n')
+        return None
+
+    def _set(self, key, value):
+        eol = _line_ending(self.lines[0]) or '\n'
+        for i, line in enumerate(self.lines):
+            if line.startswith(key + ' '):
+                self.lines[i] = key + ' ' + value + eol
+                return
+        self.lines.insert(len(self.lines) - 1, key + ' ' + value + eol)
+
+    description = property(lambda self: self._get('D'), lambda self, value: self._set('D', value))
+    keywords = property(lambda self: self._get('K'), lambda self, value: self._set('K', value))
+    datasheet = property(lambda self: self._get('F'), lambda self, value: self._set('F', value))
+
+    def dumps(self):
+        return ''.join(self.preamble) + ''.join(self.lines)
+
+    def __repr__(self):
+        return 'DocEntry({!r})'.format(self.name)
+
+
+class DocLibrary:
+    """An EESchema-DOCLIB (.dcm) file"""
+
+    __slots__ = ('header', 'entries', 'trailer', '_by_name')
+
+    def __init__(self, header=None, entries=None, trailer=None):
+        self.header = header or []
+        self.entries = entries or []
+        self.trailer = trailer or []
+        self._by_name = None
+
+    @classmethod
+    def parse(cls, text):
+        lines = text.splitlines(True)
+        if not lines or not lines[0].startswith('EESchema-DOCLIB'):
+            raise ValueError('not an EESchema-DOCLIB file')
+
+        entries = []
+        pending = []
+        entry_lines = None
+        for line in lines[1:]:
+            if entry_lines is None:
+                if line.startswith('$CMP'):
+                    entry_lines = [line]
+                else:
+                    pending.append(line)
+            else:
+                entry_lines.append(line)
+                if line.startswith('$ENDCMP'):
+                    name = entry_lines[0][len('$CMP'):].strip()
+                    entries.append(DocEntry(name, pending, entry_lines))
+                    pending = []
+                    entry_lines = None
+        if entry_lines is not None:
+            raise ValueError('$CMP {} has no $ENDCMP'.format(entry_lines[0][len('$CMP'):].strip()))
+        return cls([lines[0]], entries, pending)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r', encoding='utf-8', newline='') as f:
+            return cls.parse(f.read())
+
+    def dumps(self):
+        return ''.join(self.header) + ''.join(e.dumps() for e in self.entries) + ''.join(self.trailer)
+
+    def save(self, filename):
+        """Write the doc library to filename, one entry at a time, replacing it atomically"""
+        with atomic_write(filename, 'w', encoding='utf-8', newline='') as f:
+            f.writelines(self.header)
+            for entry in self.entries:
+                f.write(entry.dumps())
+            f.writelines(self.trailer)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self._index()
+
+    def __getitem__(self, name):
+        return self._index()[name]
+
+    def _index(self):
+        if self._by_name is None or len(self._by_name) != len(self.entries):
+            self._by_name = {e.name: e for e in self.entries}
+        return self._by_name
@@ -0,0 +1,329 @@
+"""
+    @package
+    Client for looking up part information on LCSC, shared by the priced BOM
+    plugin and the library updater.
+
+    LcscClient.lookup_many() looks up many parts at once with a pool of worker
+    threads, all sharing a RateLimiter so that LCSC doesn't start refusing
+    requests. The LCSC address can be changed with the LCSC_BASE_URL environment
+    variable, e.g. to point it at a local stand-in server for testing, and the
+    number of part numbers per search with LCSC_BATCH_SIZE.
+
+    requests (and the thread pool) are only imported once something is actually
+    looked up, as importing requests takes longer than the rest of a BOM plugin
+    run does when every part is already in the part database.
+"""
+
+import os
+import re
+import threading
+import time
+
+from lcsc_part_db import LcscPart
+
+base_url = os.environ.get('LCSC_BASE_URL', 'https://lcsc.com')
+default_batch_size = int(os.environ.get('LCSC_BATCH_SIZE', '1'))
+
+
+class RateLimiter:
+    """Token bucket rate limiter, shared between threads.
+
+    Allows up to rate requests per second on average, with bursts of up to burst
+    requests. backoff() pauses every caller for a while and halves the rate, and
+    each success() lets the rate creep back up towards the original rate.
+    """
+
+    def __init__(self, rate=2.0, burst=2, min_rate=0.1):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request is allowed"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                    self._last = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+            time.sleep(wait)
+
+    def backoff(self, delay):
+        """Stop all requests for delay seconds, and halve the request rate"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                # another thread has already backed off for the same burst of errors
+                return
+            self._paused_until = max(self._paused_until, now + delay)
+            self._last = self._paused_until
+            self._tokens = 0.0
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate * 1.1)
+
+
+class RequestStats:
+    """Latency statistics for the requests made by an LcscClient"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.min_time = None
+        self.max_time = None
+        self.status_counts = dict()
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, status_code):
+        with self._lock:
+            self.count += 1
+            self.total_time += elapsed
+            if self.min_time is None or elapsed < self.min_time:
+                self.min_time = elapsed
+            if self.max_time is None or elapsed > self.max_time:
+                self.max_time = elapsed
+            self.status_counts[status_code] = self.status_counts.get(status_code, 0) + 1
+
+    def summary(self):
+        if self.count == 0:
+            return 'LCSC requests: none'
+        statuses = ', '.join('{}: {}'.format(k, v) for k, v in sorted(self.status_counts.items()))
+        return 'LCSC requests: {}, latency min/mean/max {:.3f}/{:.3f}/{:.3f} s, status codes {}'.format(
+            self.count, self.min_time, self.total_time / self.count, self.max_time, statuses)
+
+
+default_headers = {
+    'pragma': 'no-cache',
+    'cache-control': 'no-cache',
+    'accept': 'application/json, text/javascript, */*; q=0.01',
+    'x-requested-with': 'XMLHttpRequest',
+    'user-agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.116 Safari/537.36',
+    'isajax': 'true',
+    'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
+    'origin': 'https://lcsc.com',
+    'sec-fetch-site': 'same-origin',
+    'sec-fetch-mode': 'cors',
+    'sec-fetch-dest': 'empty',
+    'referer': 'https://lcsc.com',
+    'accept-language': 'cs,en;q=0.9,sk;q=0.8,en-GB;q=0.7',
+}
+
+
+class LcscClient:
+    """Client for the LCSC product search API.
+
+    All requests go through one requests.Session, so connections are kept alive and
+    reused (up to pool_size of them, for concurrent lookups). Nothing is set up until
+    the first request: the session is created, and the CSRF token and session cookies
+    fetched, on first use, so a client which is never used costs nothing. The token
+    is fetched again if LCSC reports that it has expired. Rate limited and Bad
+    Gateway responses are retried up to max_attempts times, backing off the shared
+    rate limiter by rate_limit_delay or bad_gateway_delay seconds. Requests time out
+    after timeout seconds, and timeouts and connection errors are retried too, after
+    connection_error_delay seconds. If a search still fails its parts are left out
+    of the results, and once one has failed because LCSC can't be reached the
+    remaining searches aren't tried. Request latencies are collected in self.stats.
+
+    lookup_many() puts up to batch_size part numbers in each search. The public LCSC
+    search only reliably finds one part number per search, so batch_size defaults to
+    1 (or the LCSC_BATCH_SIZE environment variable); raise it for endpoints (or
+    stand-ins) which accept several space separated part numbers. It must not be
+    more than the number of results on a page.
+    """
+
+    def __init__(self, url=None, rate_limiter=None, max_attempts=5, rate_limit_delay=10,
+                 bad_gateway_delay=5, pool_size=8, batch_size=None, timeout=10, connection_error_delay=2):
+        self.url = url or base_url
+        self.batch_size = batch_size or default_batch_size
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_attempts = max_attempts
+        self.rate_limit_delay = rate_limit_delay
+        self.bad_gateway_delay = bad_gateway_delay
+        self.timeout = timeout
+        self.connection_error_delay = connection_error_delay
+        self.stats = RequestStats()
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._token = None
+        self._connect_lock = threading.Lock()
+        self._unreachable = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    import requests.adapters
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    session.headers.update(default_headers)
+                    self._session = session
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.monotonic()
+        res = self.session.request(method, self.url + path, **kwargs)
+        self.stats.record(time.monotonic() - start, res.status_code)
+        return res
+
+    def connect(self, stale_token=None):
+        """Get a CSRF token (and session cookies) from the search page.
+
+        If stale_token is given, only reconnect if no other thread already has since
+        that token was found to be expired.
+        """
+        with self._connect_lock:
+            if self._token is not None and self._token != stale_token:
+                return
+            search_page = self._request('GET', '/products/Pre-ordered-Products_11171.html')
+            self._token = extract_csrf_token(search_page.text)
+            self.session.headers['x-csrf-token'] = self._token
+
+    def lookup(self, part_no):
+        """Fetch the LcscPart for part_no from LCSC. Returns None if it can't be found"""
+        return self._lookup_batch([part_no]).get(part_no)
+
+    def lookup_many(self, part_numbers, max_workers=4):
+        """Look up part_numbers on LCSC.
+
+        Duplicates are only looked up once, and the part numbers are searched for
+        batch_size at a time, with the batches fetched concurrently. Returns a dict
+        of part number to LcscPart. Parts which couldn't be found are left out.
+        """
+        part_numbers = sorted(set(part_numbers))
+        parts = dict()
+        if not part_numbers:
+            return parts
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        batches = [part_numbers[i:i + self.batch_size] for i in range(0, len(part_numbers), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for batch_parts in pool.map(self._lookup_batch, batches):
+                parts.update(batch_parts)
+        return parts
+
+    def _lookup_batch(self, part_numbers):
+        """Search for part_numbers in a single request, returning a dict of part number
+        to LcscPart"""
+        import requests
+
+        connection_error = None
+        for attempt in range(self.max_attempts):
+            if self._unreachable:
+                return dict()
+            token = self._token
+            try:
+                if token is None:
+                    self.connect()
+                    token = self._token
+                self.rate_limiter.acquire()
+                res = self._request('POST', '/api/products/search',
+                                    data={
+                                        "current_page": "1",
+                                        "in_stock": "false",
+                                        "is_RoHS": "false",
+                                        "show_icon": "false",
+                                        "search_content": ' '.join(part_numbers),
+                                    })
+                connection_error = None
+                if is_csrf_expired(res):
+                    print("CSRF token expired, reconnecting")
+                    self.connect(stale_token=token)
+                    continue
+            except requests.RequestException as e:
+                connection_error = e
+                print("Couldn't reach LCSC ({}), try again in a second".format(type(e).__name__))
+                # only this search waits: LCSC isn't refusing requests, so there's no
+                # need to slow the others down
+                time.sleep(self.connection_error_delay)
+                continue
+            if is_rate_limited(res):
+                print("Too many requests! Waiting")
+                self.rate_limiter.backoff(self.rate_limit_delay)
+            elif res.status_code == 502 or "Bad Gateway" in res.text:
+                print("Bad gateway, try again in a second")
+                self.rate_limiter.backoff(self.bad_gateway_delay)
+            else:
+                self.rate_limiter.success()
+                return parse_search_response(part_numbers, res)
+
+        print(" --Warning, giving up on {} after {} attempts".format(', '.join(part_numbers), self.max_attempts))
+        if connection_error is not None and not self._unreachable:
+            self._unreachable = True
+            print(" --Warning, LCSC can't be reached, not looking up any more parts")
+        return dict()
+
+
+def extract_csrf_token(page_text):
+    m = re.search(r"'X-CSRF-TOKEN':\s*'(.*)'", page_text)
+    if not m:
+        return None
+    return m.group(1)
+
+
+def is_csrf_expired(res):
+    # LCSC is a Laravel site, which answers 419 to requests with a stale CSRF token
+    return res.status_code == 419 or "CSRF token mismatch" in res.text
+
+
+def is_rate_limited(res):
+    if res.status_code == 429 or "exceeded the maximum number of attempts" in res.text:
+        return True
+    try:
+        return res.json()["code"] == 429
+    except (ValueError, KeyError, TypeError):
+        return False
+
+
+def parse_search_response(part_numbers, res):
+    """Return a dict of part number to LcscPart for the part_numbers found in a
+    products/search response"""
+    parts = dict()
+    try:
+        results = res.json()["result"]["data"]
+        for component in results:
+            part_no = component["number"]
+            if part_no in part_numbers and part_no not in parts:
+                parts[part_no] = LcscPart(part_no, [list(b) for b in component['price']],
+                                          component['stock'], component['package'], time.time())
+                if len(component['price']) == 0:
+                    print(" --Warning, no price info for {}".format(part_no))
+        for part_no in part_numbers:
+            if part_no not in parts:
+                print(" --Warning, {} isn't in the search results - len(results) = {}".format(part_no, len(results)))
+    except Exception as e:
+        print("  Cannot parse response for components {}".format(', '.join(part_numbers)))
+        print("{}".format(type(e)))
+        print("  Error: {}".format(e))
+        print("  Response: {}".format(res.text))
+    return parts
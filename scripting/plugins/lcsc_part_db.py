@@ -0,0 +1,196 @@
+"""
+    @package
+    Local SQLite database of LCSC part information (price breaks, stock and
+    package), keyed by LCSC part number.
+
+    Shared by the priced BOM plugin and the library updater ("update LCSC parts.py"),
+    so parts fetched by one don't need to be fetched again by the other. The
+    database is opened in WAL mode, so several BOM runs can read it at once.
+
+    The updater also records, per library symbol, a hash of the symbol and when
+    its price was last checked, so unchanged symbols can be skipped.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+from filecache import LruCache, TtlLruCache
+
+default_filename = os.path.join(tempfile.gettempdir(), 'lcsc_parts.sqlite3')
+
+# price_breaks is a list of [quantity, unit price in USD] pairs, as returned by LCSC.
+# fetched_at is the time.time() the part info was fetched from LCSC.
+LcscPart = namedtuple('LcscPart', ['part_no', 'price_breaks', 'stock', 'package', 'fetched_at'])
+
+
+class PartDatabase:
+    """SQLite store of LcscPart records.
+
+    Use as a context manager. Writes are committed every flush_every updates and
+    when the database is closed. If ttl (seconds) is set, get() ignores parts
+    fetched longer ago than that.
+
+    Parts which have been read or written are also kept in memory, in an LRU cache
+    of up to memory_size bytes (as estimated by part_size()), so looking the same
+    part up again doesn't touch the database. Part numbers which aren't in the
+    database are remembered too, until they are put. The memory cache's
+    hit/miss/eviction counters are in self.memory.stats().
+
+    By default puts are written through to the database straight away (and
+    committed every flush_every puts). With write_back=True they are only kept in
+    memory until flush_every parts are waiting, or flush() or close() is called.
+    """
+
+    def __init__(self, filename=default_filename, ttl=None, flush_every=50,
+                 memory_size=4 * 1024 * 1024, write_back=False):
+        self.filename = filename
+        self.ttl = ttl
+        self.flush_every = flush_every
+        self.write_back = write_back
+        self._conn = None
+        self._pending = 0
+        # parts which have been put, but not yet written to the database (write back only)
+        self._dirty = dict()
+        self._missing = set()
+        if ttl is None:
+            self.memory = LruCache(memory_size, getsizeof=part_size)
+        else:
+            self.memory = TtlLruCache(memory_size, ttl, getsizeof=part_size)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        self._conn = sqlite3.connect(self.filename, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS parts (
+                part_no TEXT PRIMARY KEY,
+                price_breaks TEXT NOT NULL,
+                stock INTEGER,
+                package TEXT,
+                fetched_at REAL NOT NULL
+            )''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS parts_fetched_at ON parts (fetched_at)')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS symbols (
+                library TEXT NOT NULL,
+                name TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                checked_at REAL NOT NULL,
+                PRIMARY KEY (library, name)
+            )''')
+        self._conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
+
+    def flush(self):
+        if self._dirty:
+            self._write(self._dirty.values())
+            self._dirty.clear()
+        self._conn.commit()
+        self._pending = 0
+
+    def get(self, part_no, default=None):
+        """Return the LcscPart for part_no, or default if it isn't stored (or has expired)"""
+        part = self.memory.get(part_no)
+        if part is None:
+            part = self._dirty.get(part_no)
+        if part is None:
+            if part_no in self._missing:
+                return default
+            row = self._conn.execute(
+                'SELECT part_no, price_breaks, stock, package, fetched_at FROM parts WHERE part_no = ?',
+                (part_no,)).fetchone()
+            if row is None:
+                self._missing.add(part_no)
+                return default
+            part = _row_to_part(row)
+            self.memory[part_no] = part
+        if self.ttl is not None and time.time() - part.fetched_at > self.ttl:
+            return default
+        return part
+
+    def __getitem__(self, part_no):
+        return self.get(part_no)
+
+    def __contains__(self, part_no):
+        return self.get(part_no) is not None
+
+    def put(self, part):
+        """Store (or replace) an LcscPart"""
+        self.put_many([part])
+
+    def put_many(self, parts):
+        parts = list(parts)
+        for p in parts:
+            self.memory[p.part_no] = p
+            self._missing.discard(p.part_no)
+        if self.write_back:
+            for p in parts:
+                self._dirty[p.part_no] = p
+            self._pending = len(self._dirty)
+        else:
+            self._write(parts)
+            self._pending += len(parts)
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def _write(self, parts):
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO parts (part_no, price_breaks, stock, package, fetched_at) VALUES (?, ?, ?, ?, ?)',
+            [(p.part_no, json.dumps(p.price_breaks), p.stock, p.package, p.fetched_at) for p in parts])
+
+    def get_symbol_states(self, library):
+        """Return a dict of symbol name to (content hash, checked at time) for the symbols
+        of a library which have been recorded with set_symbol_states()"""
+        rows = self._conn.execute('SELECT name, content_hash, checked_at FROM symbols WHERE library = ?',
+                                  (library,))
+        return {name: (content_hash, checked_at) for name, content_hash, checked_at in rows}
+
+    def set_symbol_states(self, library, states):
+        """Record the content hash and time the prices were last checked for symbols of a
+        library. states is a dict of symbol name to (content hash, checked at time)"""
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO symbols (library, name, content_hash, checked_at) VALUES (?, ?, ?, ?)',
+            [(library, name, content_hash, checked_at) for name, (content_hash, checked_at) in states.items()])
+        self._conn.commit()
+
+    def cache_summary(self):
+        stats = self.memory.stats()
+        return 'Part cache: {} hits, {} misses, {} evictions, {} parts ({}/{} bytes) in memory'.format(
+            stats['hits'], stats['misses'], stats['evictions'], len(self.memory),
+            stats['currsize'], stats['maxsize'])
+
+    def parts_older_than(self, age):
+        """Return the part numbers which were fetched more than age seconds ago"""
+        rows = self._conn.execute('SELECT part_no FROM parts WHERE fetched_at < ? ORDER BY fetched_at',
+                                  (time.time() - age,))
+        return [row[0] for row in rows]
+
+
+def part_size(part):
+    """Estimate the memory used by an LcscPart, in bytes"""
+    size = sys.getsizeof(part) + sys.getsizeof(part.part_no) + sys.getsizeof(part.package) \
+        + sys.getsizeof(part.price_breaks)
+    for price_break in part.price_breaks:
+        size += sys.getsizeof(price_break) + sum(sys.getsizeof(x) for x in price_break)
+    return size
+
+
+def _row_to_part(row):
+    part_no, price_breaks, stock, package, fetched_at = row
+    return LcscPart(part_no, json.loads(price_breaks), stock, package, fetched_at)
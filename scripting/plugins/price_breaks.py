@@ -0,0 +1,100 @@
+"""
+    @package
+    Costing with LCSC price breaks.
+
+    LCSC prices come as a table of [quantity, unit price] breaks: ordering at
+    least quantity of a part costs unit price each. PriceTable finds the break
+    for an order quantity with a bisect over the break quantities, and can also
+    find the cheapest quantity to actually order, which can be more than is
+    needed when the next break up costs less in total.
+
+    Example:
+        table = PriceTable([[10, 0.05], [100, 0.02], [1000, 0.01]])
+        table.cost(80)                 # Cost(80, 80, 0.05, 4.0)
+        table.cost(80, cheapest=True)  # Cost(80, 100, 0.02, 2.0)
+"""
+
+import bisect
+from collections import namedtuple
+
+# quantity is the number needed, order_quantity the number to order (at least the
+# minimum order quantity), unit_price the price of each at order_quantity, and total
+# the price of the whole order
+Cost = namedtuple('Cost', ['quantity', 'order_quantity', 'unit_price', 'total'])
+
+
+class PriceTable:
+    """A part's price breaks, sorted by quantity"""
+
+    __slots__ = ('quantities', 'prices')
+
+    def __init__(self, price_breaks):
+        # keep the lowest price if a quantity is listed more than once
+        lowest = dict()
+        for quantity, price in price_breaks:
+            quantity = int(quantity)
+            price = float(price)
+            if quantity not in lowest or price < lowest[quantity]:
+                lowest[quantity] = price
+        self.quantities = sorted(lowest)
+        self.prices = [lowest[quantity] for quantity in self.quantities]
+
+    def __len__(self):
+        return len(self.quantities)
+
+    @property
+    def minimum_quantity(self):
+        return self.quantities[0]
+
+    def unit_price(self, quantity):
+        """Return the price of each part when ordering quantity of them. Quantities below
+        the first break are priced at the first break, since that is the least that can
+        be ordered"""
+        return self.prices[max(0, bisect.bisect_right(self.quantities, quantity) - 1)]
+
+    def cost(self, quantity, cheapest=False):
+        """Return the Cost of needing quantity parts.
+
+        The order quantity is quantity, or the minimum order quantity if that is more.
+        If cheapest is set, ordering at each higher price break is considered too, and
+        the order quantity is the one with the lowest total.
+        """
+        order_quantity = max(quantity, self.quantities[0])
+        i = max(0, bisect.bisect_right(self.quantities, order_quantity) - 1)
+        best = Cost(quantity, order_quantity, self.prices[i], self.prices[i] * order_quantity)
+        if cheapest:
+            for break_quantity, price in zip(self.quantities[i + 1:], self.prices[i + 1:]):
+                if break_quantity * price < best.total:
+                    best = Cost(quantity, break_quantity, price, break_quantity * price)
+        return best
+
+
+def cost_lines(tables, quantities, cheapest=False, keys=None):
+    """Cost a whole BOM at once. tables and quantities are parallel sequences of the
+    PriceTable (or None, for a part without prices) and quantity needed of each line.
+    Returns a list of Costs, with None for the lines without prices.
+
+    keys, if given, is a parallel sequence of what each line orders (e.g. its LCSC
+    part number). Lines with the same key are ordered together: the order is costed
+    once, on their total quantity, every one of them gets its unit price, and any
+    extra ordered above the total needed goes on the first of them.
+    """
+    if keys is None:
+        keys = range(len(quantities))
+    totals = dict()
+    for key, quantity in zip(keys, quantities):
+        totals[key] = totals.get(key, 0) + quantity
+
+    orders = dict()
+    costs = []
+    for table, quantity, key in zip(tables, quantities, keys):
+        if not table:
+            costs.append(None)
+            continue
+        order_quantity = quantity
+        if key not in orders:
+            orders[key] = table.cost(totals[key], cheapest)
+            order_quantity += orders[key].order_quantity - orders[key].quantity
+        unit_price = orders[key].unit_price
+        costs.append(Cost(quantity, order_quantity, unit_price, unit_price * order_quantity))
+    return costs
@@ -0,0 +1,148 @@
+"""
+    @package
+    Checks that the "sax" and "etree" netlist parsers build the same tree, with
+    and without section filtering.
+
+    Run with: python -m pytest scripting/plugins
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import kicad_netlist_reader  # noqa: E402
+
+# A cut down KiCad 5 generic netlist, with every section the BOM plugins read
+NETLIST = """<?xml version="1.0" encoding="utf-8"?>
+<export version="D">
+  <design>
+    <source>/home/matt/board/board.sch</source>
+    <date>Sat 19 Oct 2019 10:12:03 AEDT</date>
+    <tool>Eeschema 5.1.4</tool>
+    <sheet number="1" name="/" tstamps="/">
+      <title_block>
+        <title>Board &amp; "friends"</title>
+        <company/>
+        <rev>1</rev>
+        <comment number="1" value=""/>
+      </title_block>
+    </sheet>
+  </design>
+  <components>
+    <comp ref="C1">
+      <value>100n</value>
+      <footprint>Capacitor_SMD:C_0603_1608Metric</footprint>
+      <datasheet>~</datasheet>
+      <fields>
+        <field name="LCSC Part #">C14663</field>
+      </fields>
+      <libsource lib="matt_C_0603" part="100n" description="Unpolarized capacitor"/>
+      <sheetpath names="/" tstamps="/"/>
+      <tstamp>5D9A1B2C</tstamp>
+    </comp>
+    <comp ref="R1">
+      <value>10k</value>
+      <footprint>Resistor_SMD:R_0603_1608Metric</footprint>
+      <fields>
+        <field name="LCSC Part #">C25804</field>
+        <field name="Installed">NU</field>
+      </fields>
+      <libsource lib="matt_R_0603" part="10k" description="Resistor"/>
+      <sheetpath names="/" tstamps="/"/>
+      <tstamp>5D9A1B2D</tstamp>
+    </comp>
+    <comp ref="U1">
+      <value>LM358</value>
+      <footprint>Package_SO:SOIC-8_3.9x4.9mm_P1.27mm</footprint>
+      <libsource lib="MY_LIB" part="LM358" description="Dual op amp"/>
+      <sheetpath names="/" tstamps="/"/>
+      <tstamp>5D9A1B2E</tstamp>
+    </comp>
+  </components>
+  <libparts>
+    <libpart lib="matt_C_0603" part="100n">
+      <description>Unpolarized capacitor</description>
+      <footprints>
+        <fp>C_*</fp>
+      </footprints>
+      <fields>
+        <field name="Reference">C</field>
+        <field name="Value">100n</field>
+      </fields>
+      <pins>
+        <pin num="1" name="~" type="passive"/>
+        <pin num="2" name="~" type="passive"/>
+      </pins>
+    </libpart>
+    <libpart lib="MY_LIB" part="LM358">
+      <aliases>
+        <alias>LM2904</alias>
+      </aliases>
+      <footprints>
+        <fp>SOIC*3.9x4.9mm*P1.27mm*</fp>
+        <fp>DIP*W7.62mm*</fp>
+      </footprints>
+      <fields>
+        <field name="Reference">U</field>
+        <field name="Value">LM358</field>
+      </fields>
+    </libpart>
+  </libparts>
+  <libraries>
+    <library logical="MY_LIB">
+      <uri>/home/matt/user-symbols/MY_LIB.lib</uri>
+    </library>
+  </libraries>
+  <nets>
+    <net code="1" name="GND">
+      <node ref="C1" pin="2"/>
+      <node ref="U1" pin="4"/>
+    </net>
+    <net code="2" name="Net-(C1-Pad1)">
+      <node ref="C1" pin="1"/>
+      <node ref="R1" pin="1"/>
+    </net>
+  </nets>
+</export>
+"""
+
+SECTIONS = [None, {'design', 'components', 'libparts'}, {'nets'}, set()]
+
+
+@pytest.fixture
+def netlist_file(tmp_path):
+    filename = tmp_path / 'board.xml'
+    filename.write_text(NETLIST, encoding='utf-8')
+    return str(filename)
+
+
+@pytest.mark.parametrize('sections', SECTIONS)
+def test_parsers_build_the_same_tree(netlist_file, sections):
+    sax = kicad_netlist_reader.netlist(netlist_file, sections=sections, parser='sax')
+    etree = kicad_netlist_reader.netlist(netlist_file, sections=sections, parser='etree')
+    assert etree.formatXML() == sax.formatXML()
+
+
+@pytest.mark.parametrize('sections', SECTIONS[:2])
+def test_parsers_give_the_same_components(netlist_file, sections):
+    def summary(net):
+        return [(c.getRef(), c.getValue(), c.getFootprint(), c.getField('LCSC Part #'), c.getLibName(),
+                 c.getPartName(), c.getLibPart() and c.getLibPart().getFootprintFilters())
+                for c in net.getInterestingComponents()]
+
+    sax = kicad_netlist_reader.netlist(netlist_file, sections=sections, parser='sax')
+    etree = kicad_netlist_reader.netlist(netlist_file, sections=sections, parser='etree')
+    assert summary(etree) == summary(sax)
+    assert [c[0] for c in summary(sax)] == ['C1', 'U1']
+    assert summary(sax)[1][-1] == ['SOIC*3.9x4.9mm*P1.27mm*', 'DIP*W7.62mm*']
+
+
+def test_text_after_a_child_element(tmp_path):
+    filename = tmp_path / 'mixed.xml'
+    filename.write_text('<export version="D"><design>pre<b>in</b>post</design></export>', encoding='utf-8')
+    trees = [kicad_netlist_reader.netlist(str(filename), parser=parser).formatXML()
+             for parser in kicad_netlist_reader.PARSERS]
+    assert trees[0] == trees[1]
+    assert 'prepost' in trees[0]
@@ -0,0 +1,110 @@
+"""
+    @package
+    Checks of the parsing of the libraries in user-symbols, and of the byte offset
+    patching of .lib files (SymbolIndex) and the backups made before a library is
+    replaced, against copies of them.
+
+    Run with: python -m pytest scripting/plugins
+"""
+
+import glob
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import kicad_symbol_lib  # noqa: E402
+from kicad_symbol_lib import DocLibrary, SymbolIndex, SymbolLibrary, backup_file  # noqa: E402
+
+USER_SYMBOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'user-symbols')
+LIBRARY = 'matt_R_0603.lib'
+
+
+def spans(index):
+    return [[name, span.start, span.end, span.content_hash, span.fields] for name, span in index.symbols.items()]
+
+
+@pytest.fixture
+def library(tmp_path):
+    filename = str(tmp_path / LIBRARY)
+    shutil.copyfile(os.path.join(USER_SYMBOLS, LIBRARY), filename)
+    return filename
+
+
+def edit_symbols(index):
+    """Change a field of one symbol, add a field to another and two to a third,
+    leaving untouched symbols between and after them. Returns the edited Symbols"""
+    names = list(index)
+    changed, one_new, two_new = index.read_symbols([names[1], names[5], names[9]])
+    changed.set_field('LCSC Part #', 'C1234567')
+    one_new.set_field('Price', '0.0012')
+    two_new.set_field('Price', '0.0034')
+    two_new.set_field('Checked', '2019-10-19')
+    return [changed, one_new, two_new]
+
+
+@pytest.mark.parametrize('filename', sorted(glob.glob(os.path.join(USER_SYMBOLS, '*.lib')) +
+                                            glob.glob(os.path.join(USER_SYMBOLS, '*.dcm'))),
+                         ids=os.path.basename)
+def test_parse_dumps_round_trip(filename):
+    with open(filename, 'r', encoding='utf-8', newline='') as f:
+        text = f.read()
+    library_class = SymbolLibrary if filename.endswith('.lib') else DocLibrary
+    assert library_class.parse(text).dumps() == text
+
+
+def test_patch_shifts_the_index(library):
+    index = SymbolIndex.load(library)
+    symbols = edit_symbols(index)
+    assert index.patch(symbols, backup='none')
+
+    rebuilt = SymbolIndex.build(library)
+    assert spans(index) == spans(rebuilt)
+    assert (index.size, index.mtime_ns) == (rebuilt.size, rebuilt.mtime_ns)
+    assert spans(SymbolIndex.load(library)) == spans(rebuilt)
+
+    patched = SymbolLibrary.load(library)
+    for symbol in symbols:
+        assert [f.dumps() for f in patched[symbol.name].fields] == [f.dumps() for f in symbol.fields]
+    assert patched[symbols[2].name].get_field('Checked') == '2019-10-19'
+
+    # patching again from the shifted index, without rescanning the file
+    again = index.read_symbols([symbols[2].name])
+    again[0].set_field('Price', '0.05')
+    assert index.patch(again, backup='none')
+    assert spans(index) == spans(SymbolIndex.build(library))
+
+
+@pytest.mark.skipif(shutil.which('patch') is None, reason='needs patch')
+def test_diff_backup_restores_the_old_library(library):
+    with open(library, 'rb') as f:
+        old = f.read()
+    index = SymbolIndex.load(library)
+    assert index.patch(edit_symbols(index), backup='diff')
+
+    backups = glob.glob(glob.escape(library) + '.bak_*.diff')
+    assert len(backups) == 1
+    subprocess.run(['patch', '-R', '-s', library, backups[0]], check=True)
+    with open(library, 'rb') as f:
+        assert f.read() == old
+
+
+@pytest.mark.parametrize('mode', ['copy', 'hardlink'])
+def test_keep_deletes_the_oldest_backups(library, mode):
+    made = [backup_file(library, mode, keep=2) for _ in range(4)]
+    assert sorted(glob.glob(glob.escape(library) + '.bak_*')) == sorted(made[2:])
+
+
+def test_keep_counts_diff_backups(library):
+    index = SymbolIndex.load(library)
+    for price in ['0.01', '0.02', '0.03']:
+        symbols = index.read_symbols([list(index)[0]])
+        symbols[0].set_field('Price', price)
+        assert index.patch(symbols, backup='diff', keep_backups=2)
+    backups = sorted(glob.glob(glob.escape(library) + '.bak_*'), key=kicad_symbol_lib._backup_sort_key)
+    assert len(backups) == 2
+    with open(backups[-1], 'r', encoding='utf-8') as f:
+        assert '+F5 "0.03"' in f.read()
@@ -1,26 +1,23 @@
+import argparse
+import glob
 import os
-import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from typing import Optional
-import requests
 import time
-import shutil
-import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripting', 'plugins'))
+from currency import ExchangeRates, default_currency
+from kicad_symbol_lib import BACKUP_MODES, SymbolIndex
+from lcsc_client import LcscClient
+from lcsc_part_db import PartDatabase
+from price_breaks import PriceTable
 
 filename_root = 'D:/programs/kicad/user-library/user-symbols/LCSC parts'
 lib_file = filename_root + '.lib'
 dcm_file = filename_root + '.dcm'
-
-
-def obtainCsrfTokenAndCookies():
-    search_page = requests.get("https://lcsc.com/products/Pre-ordered-Products_11171.html")
-    return extractCsrfToken(search_page.text), search_page.cookies
-
-
-def extractCsrfToken(page_text):
-    m = re.search(r"'X-CSRF-TOKEN':\s*'(.*)'", page_text)
-    if not m:
-        return None
-    return m.group(1)
+default_max_age_days = 7
+default_keep_backups = 5
 
 
 def check_files():
@@ -30,154 +27,187 @@ def check_files():
         raise FileNotFoundError(f"Couldn't find dcm file {dcm_file}")
 
 
-def usd2aud(usd):
-    if usd2aud.exchange_rate is None:
-        res = requests.get('https://api.exchangeratesapi.io/latest?base=AUD&symbols=USD')
-        usd2aud.exchange_rate = res.json()['rates']['USD']
-
-    return usd/usd2aud.exchange_rate
-usd2aud.exchange_rate = None
-
-
-def split_string_with_quotes(s):
-    return re.findall(r"(?:\".*?\"|\S)+", s)
-
-def process_F_fields(f_fields, headers, cookies):
-    price_field = None
-    part_no = None
-    for field in f_fields:
-        cols = split_string_with_quotes(field)
-        if len(cols) == 10:
-            field_name = cols[9]
-            if field_name == '"LCSC Part #"':
-                part_no = cols[1][1:-1]  #strip quote marks
-            elif field_name == '"Price"':
-                price_field = field
-    if part_no:
-        new_price = lookup_price(part_no, headers, cookies)
-        if price_field:
-            split_price_field = split_string_with_quotes(price_field)
-            split_price_field[1] = f'"{new_price:.4f}"'
-            price_field = ' '.join(split_price_field)
-        else:
-            f_fields.append(f'F{len(f_fields)} "{new_price:.4f}" 0 0 50 H I C CNN "Price"')
+def collect_part_numbers(span):
+    """Return the set of LCSC part numbers in the fields of a library symbol's SymbolSpan"""
+    return set(value for _, _, name, value in span.fields if name == 'LCSC Part #' and value)
+
+
+def update_symbol_price(symbol, prices) -> bool:
+    """Set the Price field of a library symbol from the price of its LCSC part. Returns
+    whether there was a price to set"""
+    part_no = symbol.get_field('LCSC Part #')
+    if not part_no:
+        print(f' --Warning: No "LCSC Part #" field for part <{symbol.get_field("Value")}>')
+    elif prices.get(part_no) is None:
+        print(f' --Warning: No price for {part_no}')
     else:
-        print(f' --Warning: No "LCSC Part #" field for part <{split_string_with_quotes(f_fields[1])[1]}>')
-    return f_fields
+        symbol.set_field('Price', f'{prices[part_no]:.4f}')
+        return True
+    return False
 
 
-def lookup_price(part_no, headers, cookies) -> Optional[float]:
+def part_price(part_no: str, price_info: Optional[list]) -> Optional[float]:
+    """Return the price per unit of a part, from its price break table (already converted
+    to the wanted currency)"""
     price = None
-    res = requests.post("https://lcsc.com/api/products/search",
-                        headers=headers, cookies=cookies,
-                        data={
-                            "current_page": "1",
-                            "in_stock": "false",
-                            "is_RoHS": "false",
-                            "show_icon": "false",
-                            "search_content": part_no,
-                        })
-    try:
-        if "exceeded the maximum number of attempts" in res.text or res.json()["code"] == 429:
-            print("Too many requests! Waiting")
-            time.sleep(10)
-            price = lookup_price(part_no, headers, cookies)
-        else:
-            results = res.json()["result"]["data"]
-            if len(results) != 1:
-                print(f" --Warning, {part_no} doesn't have a single result/data section - len(results) = {len(results)}")
-                print(res.text)
-            else:
-                component = res.json()["result"]["data"][0]
-                if component["number"] != part_no:
-                    print(f" --Warning, {part_no} result/data/number ({component['number']}) doesn't match part no")
-                else:
-                    price_info = component['price']
-                    if len(price_info) > 0:
-                        # assume that the price info list is sorted by number of parts
-                        num_parts = price_info[0][0]
-                        price = usd2aud(price_info[0][1])
-                        if num_parts != 1:
-                            print(f" --Info: {part_no} only available in min quantity {num_parts}")
-                            price = price / num_parts
-                    else:
-                        print(f" --Warning, no price info for {part_no}")
-    except Exception as e:
-        print(f"  Cannot parse response for component {part_no}")
-        print(f"{type(e)}")
-        print(f"  Error: {e}")
-        print(f"  Response: {res.text}")
-        if "Bad Gateway" in res.text:
-            print("Bad gateway, try again in a second")
-            time.sleep(5)
+    if price_info:
+        table = PriceTable(price_info)
+        num_parts = table.minimum_quantity
+        price = table.unit_price(num_parts)
+        if num_parts != 1:
+            print(f" --Info: {part_no} only available in min quantity {num_parts}")
+            price = price / num_parts
     return price
 
 
-def init_lcsc_connection():
-    token, cookies = obtainCsrfTokenAndCookies()
-    headers = {
-        'pragma': 'no-cache',
-        'cache-control': 'no-cache',
-        'accept': 'application/json, text/javascript, */*; q=0.01',
-        'x-csrf-token': token,
-        'x-requested-with': 'XMLHttpRequest',
-        'user-agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.116 Safari/537.36',
-        'isajax': 'true',
-        'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
-        'origin': 'https://lcsc.com',
-        'sec-fetch-site': 'same-origin',
-        'sec-fetch-mode': 'cors',
-        'sec-fetch-dest': 'empty',
-        'referer': 'https://lcsc.com',
-        'accept-language': 'cs,en;q=0.9,sk;q=0.8,en-GB;q=0.7',
-    }
-    return headers, cookies
-
-
-def read_lib_file():
-    headers, cookies = init_lcsc_connection()
-
-    components = []
-    current_component = None
-    F_fields = None
-    outfile = []
-    with open(lib_file, 'r') as f:
-        for line in f:
-            if current_component is None:
-                if line.startswith('DEF'):
-                    current_component = line.split()[1]
-                    print(f'{current_component}')
-                    outfile.append(line)
-                else:
-                    outfile.append(line)
+def scan_library(lib_file):
+    """Return {symbol name: content hash} and {symbol name: set of LCSC part numbers}
+    for the symbols in a lib file"""
+    index = SymbolIndex.load(lib_file)
+    hashes = dict()
+    part_numbers = dict()
+    for name, span in index.symbols.items():
+        hashes[name] = span.content_hash
+        part_numbers[name] = collect_part_numbers(span)
+    return hashes, part_numbers
+
+
+def rewrite_library(lib_file, to_check, prices, backup='hardlink', keep_backups=default_keep_backups):
+    """Update the prices of the symbols named in to_check in a lib file. The file is
+    only backed up (see kicad_symbol_lib.backup_file()) and rewritten if a price
+    changed, and then only the changed Price fields are written; the rest of the file
+    is streamed across as it is, and the new file atomically replaces the old one.
+
+    Returns whether the file changed, and {symbol name: content hash} after the update
+    for the checked symbols which were priced. Symbols which couldn't be priced are
+    left out, so an incremental update checks them again next time.
+    """
+    index = SymbolIndex.load(lib_file)
+    symbols = index.read_symbols(name for name in to_check if name in index)
+
+    hashes = dict()
+    for symbol in symbols:
+        if update_symbol_price(symbol, prices):
+            hashes[symbol.name] = symbol.content_hash()
+
+    changed = index.patch(symbols, backup=backup, keep_backups=keep_backups)
+    return changed, hashes
+
+
+def map_libraries(fn, workers, *iterables):
+    """map() fn over the libraries, in a pool of worker processes if workers > 1"""
+    if workers == 1:
+        return list(map(fn, *iterables))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, *iterables))
+
+
+def update_libraries(lib_files, incremental=False, max_age_days=default_max_age_days, workers=1,
+                     backup='hardlink', keep_backups=default_keep_backups, currency=default_currency):
+    """Update the prices in the lib files.
+
+    The libraries are scanned for LCSC part numbers, then the union of the part
+    numbers is looked up once, then each library is rewritten (the scanning and
+    rewriting run in a pool of worker processes if workers > 1).
+
+    With incremental set, symbols which haven't changed since their prices were last
+    checked less than max_age_days ago are skipped, and parts fetched from LCSC less
+    than max_age_days ago are taken from the part database rather than fetched again.
+
+    Prices are written in currency. Libraries which change are backed up according
+    to backup, one of kicad_symbol_lib.BACKUP_MODES, keeping the newest keep_backups
+    backups of each.
+    """
+    timings = dict()
+    now = time.time()
+    max_age = max_age_days * 24 * 60 * 60
+
+    start = time.monotonic()
+    scans = map_libraries(scan_library, workers, lib_files)
+    timings['scan'] = time.monotonic() - start
+
+    with PartDatabase() as part_db:
+        start = time.monotonic()
+        to_check = []
+        part_numbers = set()
+        for lib_file, (hashes, symbol_part_numbers) in zip(lib_files, scans):
+            if incremental:
+                states = part_db.get_symbol_states(os.path.abspath(lib_file))
+                lib_to_check = set(name for name, content_hash in hashes.items()
+                                   if name not in states or states[name][0] != content_hash
+                                   or now - states[name][1] > max_age)
             else:
-                if F_fields is None:
-                    if line.startswith('F0'):
-                        F_fields = [line]
-                    elif line.startswith('ENDDEF'):
-                        components.append(current_component)
-                        current_component = None
-                        outfile.append(line)
-                    else:
-                        outfile.append(line)
-                else:
-                    if line.startswith("F"):
-                        F_fields.append(line)
-                    else:
-                        F_fields = process_F_fields(F_fields, headers, cookies)
-                        outfile += F_fields
-                        F_fields = None
-                        outfile.append(line)
-
-    backup_lib_file = f'{lib_file}.bak_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}'
-    shutil.copyfile(lib_file, backup_lib_file)
-    with open(lib_file, 'w') as f:
-        f.write('\n'.join([x.rstrip() for x in outfile]))
+                lib_to_check = set(hashes)
+            print(f'{lib_file}: checking {len(lib_to_check)} of {len(hashes)} symbols')
+            to_check.append(lib_to_check)
+            for name in lib_to_check:
+                part_numbers |= symbol_part_numbers[name]
+
+        # Look up every part in all the libraries in as few requests as possible
+        parts = dict()
+        if incremental:
+            for part_no in part_numbers:
+                part = part_db.get(part_no)
+                if part is not None and now - part.fetched_at <= max_age:
+                    parts[part_no] = part
+        client = LcscClient()
+        with client:
+            fetched = client.lookup_many(part_numbers - set(parts))
+        part_db.put_many(fetched.values())
+        parts.update(fetched)
+        price_tables = ExchangeRates().convert_tables({part_no: part.price_breaks for part_no, part in parts.items()},
+                                                      currency)
+        prices = {part_no: part_price(part_no, price_info) for part_no, price_info in price_tables.items()}
+        timings['fetch'] = time.monotonic() - start
+
+        start = time.monotonic()
+        results = map_libraries(rewrite_library, workers, lib_files, to_check, [prices] * len(lib_files),
+                                [backup] * len(lib_files), [keep_backups] * len(lib_files))
+        timings['rewrite'] = time.monotonic() - start
+
+        for lib_file, lib_to_check, (changed, hashes) in zip(lib_files, to_check, results):
+            print(f'{lib_file}: {"updated" if changed else "no prices changed"}')
+            unpriced = len(lib_to_check) - len(hashes)
+            if unpriced:
+                print(f' --Warning: {unpriced} symbols in {lib_file} could not be priced, and will be checked again')
+            part_db.set_symbol_states(os.path.abspath(lib_file), {name: (content_hash, now)
+                                                                  for name, content_hash in hashes.items()})
+
+    print(client.stats.summary())
+    print(f'{len(part_numbers)} part numbers in {len(lib_files)} libraries, {len(fetched)} fetched from LCSC')
+    print('Time: ' + ', '.join(f'{phase} {seconds:.2f} s' for phase, seconds in timings.items()))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Update the prices of the LCSC parts in KiCad symbol libraries')
+    parser.add_argument('--dir',
+                        help=f'update every .lib in this directory, rather than {lib_file}')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of processes to scan and rewrite libraries with in --dir mode (default %(default)s)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only check symbols which have changed, or whose prices are older than --max-age')
+    parser.add_argument('--max-age', type=float, default=default_max_age_days,
+                        help='age in days after which prices are checked again in incremental mode (default %(default)s)')
+    parser.add_argument('--currency', default=default_currency,
+                        help='currency to write prices in (default %(default)s)')
+    parser.add_argument('--backup', choices=BACKUP_MODES, default='hardlink',
+                        help='how to back up libraries which change: a hard linked snapshot, a full copy, '
+                             'a diff (restore with patch -R), or none (default %(default)s)')
+    parser.add_argument('--keep-backups', type=int, default=default_keep_backups,
+                        help='number of backups to keep of each library (default %(default)s)')
+    return parser.parse_args()
 
 
 def run():
-    check_files()
-    read_lib_file()
+    args = parse_args()
+    if args.dir:
+        lib_files = sorted(glob.glob(os.path.join(args.dir, '*.lib')))
+        update_libraries(lib_files, args.incremental, args.max_age, args.workers, args.backup, args.keep_backups,
+                         args.currency)
+    else:
+        check_files()
+        update_libraries([lib_file], args.incremental, args.max_age, 1, args.backup, args.keep_backups,
+                         args.currency)
 
 
 if __name__ == '__main__':